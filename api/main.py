@@ -1,16 +1,24 @@
 # api/main.py
+import json
 import os
+import time
+from datetime import datetime
 
 from fastapi import FastAPI, Depends, HTTPException
-from fastapi import Query
+from fastapi import Query, Response
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Session, selectinload
 
 from api.auth import get_current_user
 from shared.config import BASE_DIR, HOST, PORT, API_STATIC_DIR, DATA_DIR
+from shared.cursors import decode_cursor, encode_cursor
 from shared.db import SessionLocal
 from shared.models import Delivery, TelegramUser, Item, Order, OrderItem
+from shared.item_search import search_items
+from shared.order_queue import enqueue_order
+from shared.sync_state import get_state
 from shared.schemas import DeliveryOut, HistoryOut, ItemOut, OrderIn
 
 app = FastAPI(title="Delivery API")
@@ -44,31 +52,52 @@ def get_db():
 
 @app.get("/api/items", response_model=list[ItemOut])
 def get_items(
+    response: Response,
     q: str | None = None,
-    limit: int = 20,
-    offset: int = 0,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
     db: Session = Depends(get_db)
 ):
-    query = db.query(Item).options(joinedload(Item.images)).filter(Item.quantity > 0) # Only in stock?
-    
+    """
+    One page of in-stock items. The token of the next page is returned
+    in the X-Next-Cursor header (absent on the last page).
+    """
+    query = db.query(Item).filter(Item.quantity > 0) # Only in stock?
+
     if q:
-        query = query.filter(Item.item_name.ilike(f"%{q}%"))
-        
-    items = query.order_by(Item.updated_at.desc()).limit(limit).offset(offset).all()
-    
-    # Populate image_url
-    for item in items:
-        if item.images:
-            # Pick primary or first
-            primary_img = next((img for img in item.images if img.is_primary), item.images[0])
-            path = primary_img.file_path.replace("\\", "/")
-            if not path.startswith("/"):
-                path = "/" + path
-            item.image_url = path
-            
+        # keyset: (phase, name_latin, item_code) of the last row, see search_items
+        position = read_cursor(cursor, (int, str, str))
+        items, next_position = search_items(query, q, limit, position)
+    else:
+        # keyset: (updated_at, item_code) of the last row, served by ix_items_updated_code
+        position = read_cursor(cursor, (datetime.fromisoformat, str))
+        if position:
+            query = query.filter(tuple_(Item.updated_at, Item.item_code) < tuple_(*position))
+        items = query.order_by(Item.updated_at.desc(), Item.item_code.desc()).limit(limit + 1).all()
+        next_position = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_position = (items[-1].updated_at.isoformat(), items[-1].item_code)
+
+    if next_position:
+        response.headers["X-Next-Cursor"] = encode_cursor(list(next_position))
+
     return items
 
 
+def read_cursor(cursor: str | None, parse) -> tuple | None:
+    """Decoded sort key of a page token, each value passed through `parse`."""
+    if not cursor:
+        return None
+    try:
+        values = decode_cursor(cursor)
+        if len(values) != len(parse):
+            raise ValueError("Invalid cursor")
+        return tuple(p(v) for p, v in zip(parse, values))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.post("/api/orders")
 def create_order(
     payload: OrderIn,
@@ -111,15 +140,34 @@ def create_order(
     )
     
     db.add(new_order)
+    enqueue_order(db, new_order)  # picked up by the worker as soon as this commits
     db.commit()
     db.refresh(new_order)
-    
-    # Optional: Trigger sync immediately or let worker handle it
-    # For now, let worker handle it via "new" status
-    
+
     return {"status": "ok", "order_id": new_order.id}
 
 
+@app.get("/api/orders/{order_id}")
+def get_order_status(
+    order_id: int,
+    user: TelegramUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    order = db.query(Order).filter(
+        Order.id == order_id,
+        Order.telegram_id == user.telegram_id
+    ).first()
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    return {
+        "order_id": order.id,
+        "status": order.status,
+        "sap_doc_num": order.sap_doc_num,
+        "sap_error": order.sap_error
+    }
+
+
 # -------------------------------------------------
 # Cart Endpoints (Server-side persistence)
 # -------------------------------------------------
@@ -131,36 +179,36 @@ def get_cart(
 ):
     """Get user's cart with full item details"""
     from shared.models import Cart
-    from shared.schemas import CartItemOut
-    
-    cart_items = db.query(Cart).filter(Cart.telegram_id == user.telegram_id).all()
-    
-    result = []
-    for cart_item in cart_items:
-        db_item = db.query(Item).filter(Item.item_code == cart_item.item_code).first()
-        if not db_item:
-            continue  # Skip if item no longer exists
-        
-        # Get image URL
-        image_url = None
-        if db_item.images:
-            primary_img = next((img for img in db_item.images if img.is_primary), db_item.images[0])
-            path = primary_img.file_path.replace("\\", "/")
-            if not path.startswith("/"):
-                path = "/" + path
-            image_url = path
-        
-        result.append({
-            "item_code": db_item.item_code,
-            "item_name": db_item.item_name,
-            "quantity": cart_item.quantity,
-            "price": db_item.price,
-            "currency": db_item.currency,
-            "image_url": image_url,
-            "line_total": db_item.price * cart_item.quantity
-        })
-    
-    return result
+
+    # one round trip: cart lines joined to their items (image_url is
+    # precomputed on items); lines of items that no longer exist drop out
+    rows = (
+        db.query(
+            Cart.quantity,
+            Item.item_code,
+            Item.item_name,
+            Item.price,
+            Item.currency,
+            Item.image_url
+        )
+        .join(Item, Item.item_code == Cart.item_code)
+        .filter(Cart.telegram_id == user.telegram_id)
+        .order_by(Cart.id)
+        .all()
+    )
+
+    return [
+        {
+            "item_code": row.item_code,
+            "item_name": row.item_name,
+            "quantity": row.quantity,
+            "price": row.price,
+            "currency": row.currency,
+            "image_url": row.image_url,
+            "line_total": row.price * row.quantity
+        }
+        for row in rows
+    ]
 
 
 @app.post("/api/cart/add")
@@ -281,6 +329,13 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics/delivery-probe")
+def delivery_probe_metrics(db: Session = Depends(get_db)):
+    """ODLN change-detection probe stats, as last saved by the worker."""
+    value = get_state(db, "hana_sync.probe_metrics")
+    return json.loads(value) if value else {}
+
+
 # Routes
 @app.get("/")
 def index():
@@ -297,7 +352,7 @@ def get_today(
 ):
     deliveries = (
         db.query(Delivery)
-        .options(joinedload(Delivery.items))
+        .options(selectinload(Delivery.items))
         .filter(
             Delivery.approved == False,
             Delivery.card_code == user.card_code
@@ -318,39 +373,82 @@ def get_history(
 
     year: int | None = Query(None, ge=2000, le=2100),
     limit: int = Query(20, ge=1, le=100),
-    offset: int = Query(0, ge=0),
+    cursor: str | None = None,
+    include_total: bool = False,
 ):
-    query = db.query(Delivery).options(joinedload(Delivery.items)).filter(
-        Delivery.card_code == user.card_code
-    )
+    """
+    Keyset-paginated history, newest first. Pass `next_cursor` back as
+    `cursor` for the next page; `total` is only counted on request
+    (and cached for HISTORY_TOTAL_TTL seconds).
+    """
+    filters = [Delivery.card_code == user.card_code]
 
     if year:
         start = f"{year}-01-01"
         end = f"{year + 1}-01-01"
 
-        query = query.filter(
+        filters += [
             Delivery.date >= start,
             Delivery.date < end
-        )
+        ]
 
-    total = query.count()
+    total = history_total(db, filters, (user.card_code, year)) if include_total else None
 
-    deliveries = (
+    # Phase 1: the page keys alone, an index-only scan of ix_deliveries_history
+    page_key = (Delivery.date, Delivery.created_at, Delivery.id)
+    query = db.query(*page_key).filter(*filters)
+
+    position = read_cursor(cursor, (str, datetime.fromisoformat, int))
+    if position:
+        query = query.filter(tuple_(*page_key) < tuple_(*position))
+
+    keys = (
         query
-        .order_by(Delivery.date.desc(), Delivery.created_at.desc())
-        .limit(limit)
-        .offset(offset)
+        .order_by(Delivery.date.desc(), Delivery.created_at.desc(), Delivery.id.desc())
+        .limit(limit + 1)
         .all()
     )
 
+    next_cursor = None
+    if len(keys) > limit:
+        keys = keys[:limit]
+        date, created_at, last_id = keys[-1]
+        next_cursor = encode_cursor([date, created_at.isoformat(), last_id])
+
+    # Phase 2: those deliveries, their lines in one "IN (page ids)" query
+    # rather than a joined row per line
+    deliveries = (
+        db.query(Delivery)
+        .options(selectinload(Delivery.items))
+        .filter(Delivery.id.in_([k.id for k in keys]))
+        .order_by(Delivery.date.desc(), Delivery.created_at.desc(), Delivery.id.desc())
+        .all()
+    ) if keys else []
+
     return {
         "total": total,
         "limit": limit,
-        "offset": offset,
+        "next_cursor": next_cursor,
         "items": deliveries
     }
 
 
+# Seconds a counted history total is reused
+HISTORY_TOTAL_TTL = int(os.getenv("HISTORY_TOTAL_TTL", 60))
+
+_history_totals: dict[tuple, tuple[float, int]] = {}
+
+
+def history_total(db: Session, filters: list, key: tuple) -> int:
+    cached = _history_totals.get(key)
+    if cached and time.monotonic() - cached[0] < HISTORY_TOTAL_TTL:
+        return cached[1]
+
+    total = db.query(func.count(Delivery.id)).filter(*filters).scalar()
+    _history_totals[key] = (time.monotonic(), total)
+    return total
+
+
 # @app.get("/api/history")
 # def get_history(
 #         user: TelegramUser = Depends(get_current_user),
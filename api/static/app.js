@@ -1,7 +1,9 @@
 // =====================================
 // Telegram WebApp init
 // =====================================
-let historyOffset = 0;
+let historyCursor = null; // next page token, null on the last page
+let historyLoading = false;
+let historyRequest = 0;   // bumped per reload so stale pages are dropped
 const historyLimit = 10;
 let historyYear = new Date().getFullYear();
 let allDeliveriesMap = {}; // local cache
@@ -59,7 +61,8 @@ function spinnerHtml() {
 // -------------------------------------
 // Load deliveries
 // -------------------------------------
-async function loadDeliveries(tab) {
+// `more` appends the next history page (infinite scroll) instead of reloading
+async function loadDeliveries(tab, more = false) {
     const container = document.getElementById(tab);
     if (!container) return; // Safety check
 
@@ -67,22 +70,41 @@ async function loadDeliveries(tab) {
     const controls = document.getElementById("deliveriesControls");
     if (controls) controls.style.display = tab === "history" ? "block" : "none";
 
-    container.innerHTML = spinnerHtml();
-
     let url = `/api/${tab}`;
+    let request;
 
     if (tab === "history") {
-        url += `?year=${historyYear}&limit=${historyLimit}&offset=${historyOffset}`;
+        if (more && (historyLoading || !historyCursor)) return;
+        if (!more) historyCursor = null;
+        request = more ? historyRequest : ++historyRequest;
+        historyLoading = true;
+
+        url += `?year=${historyYear}&limit=${historyLimit}`;
+        if (historyCursor) url += `&cursor=${encodeURIComponent(historyCursor)}`;
+    }
+
+    if (tab === "history") historySentinel.remove();
+    const spinner = document.createElement("div");
+    spinner.innerHTML = spinnerHtml();
+    if (!more) container.innerHTML = "";
+    container.appendChild(spinner);
+
+    let data;
+    try {
+        const res = await apiFetch(url);
+        data = await res.json();
+    } finally {
+        spinner.remove();
+        if (tab === "history" && request === historyRequest) historyLoading = false;
     }
 
-    const res = await apiFetch(url);
-    const data = await res.json();
+    if (tab === "history" && request !== historyRequest) return; // year changed meanwhile
 
     const deliveries = tab === "history" ? data.items : data;
 
-    container.innerHTML = "";
+    if (tab === "history") historyCursor = data.next_cursor;
 
-    if (!deliveries || deliveries.length === 0) {
+    if (!more && (!deliveries || deliveries.length === 0)) {
         container.innerHTML = "<p class='text-muted text-center'>Нет доставок</p>";
         return;
     }
@@ -140,15 +162,18 @@ async function loadDeliveries(tab) {
         container.appendChild(card);
     });
 
-    if (tab === "history") {
-        document.getElementById("prevBtn").disabled = historyOffset === 0;
-        document.getElementById("nextBtn").disabled =
-            historyOffset + historyLimit >= data.total;
-    }
+    // The sentinel after the last card pulls the next page into view
+    if (tab === "history" && historyCursor) container.appendChild(historySentinel);
 
     Telegram.WebApp.expand();
 }
 
+const historySentinel = document.createElement("div");
+historySentinel.style.height = "1px";
+new IntersectionObserver(entries => {
+    if (entries.some(e => e.isIntersecting)) loadDeliveries("history", true);
+}, { rootMargin: "200px" }).observe(historySentinel);
+
 
 //async function loadDeliveries(tab) {
 //    const todayDiv = document.getElementById("today");
@@ -275,21 +300,10 @@ document.querySelectorAll("#tabs a").forEach(tab => {
 });
 
 // -------------------------------------
-// Pagination buttons logic
+// Year filter (restarts the history from its first page)
 // -------------------------------------
-document.getElementById("prevBtn").onclick = () => {
-    historyOffset = Math.max(0, historyOffset - historyLimit);
-    loadDeliveries("history");
-};
-
-document.getElementById("nextBtn").onclick = () => {
-    historyOffset += historyLimit;
-    loadDeliveries("history");
-};
-
 document.getElementById("yearSelect").onchange = (e) => {
     historyYear = e.target.value;
-    historyOffset = 0;
     loadDeliveries("history");
 };
 
@@ -258,6 +258,26 @@ function renderCart() {
     `;
 }
 
+// Poll the order until the worker has submitted it to SAP (or gave up)
+async function waitForSapOrder(orderId, userId, timeoutMs = 15000) {
+    const deadline = Date.now() + timeoutMs;
+    while (Date.now() < deadline) {
+        try {
+            const res = await fetch(`/api/orders/${orderId}`, {
+                headers: { 'X-Telegram-User-Id': userId.toString() }
+            });
+            if (res.ok) {
+                const order = await res.json();
+                if (order.status !== 'new') return order;
+            }
+        } catch (e) {
+            console.error('Order status error:', e);
+        }
+        await new Promise(resolve => setTimeout(resolve, 500));
+    }
+    return null;
+}
+
 // Checkout
 window.handleCheckout = async function () {
     const items = Object.values(cartState);
@@ -299,6 +319,7 @@ window.handleCheckout = async function () {
         }
 
         const data = await res.json();
+        const sapOrder = await waitForSapOrder(data.order_id, userId);
 
         if (tg && tg.MainButton) {
             tg.MainButton.hideProgress();
@@ -313,7 +334,13 @@ window.handleCheckout = async function () {
         cartState = {};
         renderCart();
 
-        alert(`Order #${data.order_id} placed successfully!`);
+        if (sapOrder?.status === 'synced') {
+            alert(`Order #${data.order_id} placed successfully!\nSAP order: ${sapOrder.sap_doc_num}`);
+        } else if (sapOrder?.status === 'error') {
+            alert(`Order #${data.order_id} was saved, but SAP rejected it:\n${sapOrder.sap_error}`);
+        } else {
+            alert(`Order #${data.order_id} placed successfully!`);
+        }
         navigateToSection('mainSection');
 
     } catch (e) {
@@ -5,6 +5,9 @@ const API_BASE = ""; // Relative
 // Removed local cart - now using server-side cart from cart.js
 let allItems = [];
 let searchQuery = "";
+let itemsCursor = null; // X-Next-Cursor of the last page, null at the end
+let itemsRequest = 0;   // bumped per reload so stale pages are dropped
+let itemsLoading = false;
 
 document.addEventListener("DOMContentLoaded", () => {
     initMarket();
@@ -29,29 +32,48 @@ function initMarket() {
     // No local MainButton logic here - handled by cart.js and section navigation
 }
 
-async function loadItems() {
+// `more` appends the next page (infinite scroll) instead of reloading
+async function loadItems(more = false) {
+    if (more && (itemsLoading || !itemsCursor)) return;
+    const request = more ? itemsRequest : ++itemsRequest;
+    itemsLoading = true;
+
     try {
         let url = `${API_BASE}/api/items?limit=50`;
         if (searchQuery) {
             url += `&q=${encodeURIComponent(searchQuery)}`;
         }
+        if (more) {
+            url += `&cursor=${encodeURIComponent(itemsCursor)}`;
+        }
 
         const res = await fetch(url);
         if (!res.ok) throw new Error("Failed to load items");
 
-        allItems = await res.json();
-        renderItems(allItems);
+        const items = await res.json();
+        if (request !== itemsRequest) return; // search changed meanwhile
+
+        itemsCursor = res.headers.get("X-Next-Cursor");
+        allItems = more ? allItems.concat(items) : items;
+        renderItems(items, more);
 
     } catch (e) {
         console.error(e);
+    } finally {
+        if (request === itemsRequest) itemsLoading = false;
     }
 }
 
-function renderItems(items) {
+const itemsSentinel = document.createElement("div");
+new IntersectionObserver(entries => {
+    if (entries.some(e => e.isIntersecting)) loadItems(true);
+}, { rootMargin: "400px" }).observe(itemsSentinel);
+
+function renderItems(items, append = false) {
     const grid = document.getElementById("productGrid");
     if (!grid) return;
 
-    grid.innerHTML = "";
+    if (!append) grid.innerHTML = "";
 
     items.forEach(item => {
         const card = document.createElement("div");
@@ -85,6 +107,10 @@ function renderItems(items) {
         grid.appendChild(card);
     });
 
+    // The sentinel after the grid pulls the next page into view
+    if (itemsCursor) grid.after(itemsSentinel);
+    else itemsSentinel.remove();
+
     // Sync buttons with cart state after rendering
     if (window.syncProductButtons) {
         window.syncProductButtons();
@@ -0,0 +1,93 @@
+# bench_image_encoding.py
+"""
+Reports encode time and byte size of delivery invoices per size class
+for every output format / profile in shared.image_renderer.ENCODERS.
+
+Usage: python bench_image_encoding.py [repeats]
+"""
+import io
+import os
+import sys
+import time
+
+# Add the project root to the python path
+sys.path.append(os.getcwd())
+
+from shared.image_renderer import ENCODERS, get_renderer, save_image
+
+SIZE_CLASSES = {
+    "small (5 lines)": 5,
+    "medium (30 lines)": 30,
+    "large (100 lines)": 100,
+    "huge (400 lines)": 400,
+}
+
+
+def sample_delivery(lines: int) -> dict:
+    return {
+        "document_number": "BENCH",
+        "date": "2025-01-01 00:00:00",
+        "card_code": "C00001",
+        "card_name": "ООО Тестовый клиент",
+        "sales_manager": "Менеджер",
+        "remarks": "",
+        "total_amount": 1_250_000.0 * lines,
+        "currency": "UZS",
+        "items": [
+            {
+                "item_code": f"A{i:05d}",
+                "item_name": f"Кондиционер настенный инверторный модель {i}",
+                "quantity": i % 7 + 1,
+                "price": 1_250_000.0,
+                "line_total": 1_250_000.0 * (i % 7 + 1),
+            }
+            for i in range(lines)
+        ],
+    }
+
+
+def bench(repeats: int = 3):
+    renderer = get_renderer()
+
+    print(
+        f"{'size class':<20} {'pages':>5} {'format':<6} {'profile':<9} "
+        f"{'encode ms':>10} {'bytes':>10}"
+    )
+    for label, lines in SIZE_CLASSES.items():
+        delivery = sample_delivery(lines)
+        items = delivery["items"]
+        rows = renderer.layout(items)
+        pages = renderer.paginate(rows)
+
+        # encode the pages the notification pipeline would actually send
+        images = [
+            renderer.draw_page(
+                delivery, items[start:end], rows[start:end],
+                first_index=start + 1, page=n, page_count=len(pages)
+            )
+            for n, (start, end) in enumerate(pages, 1)
+        ]
+
+        for fmt, (_, _, profiles) in ENCODERS.items():
+            for profile in profiles:
+                best = None
+                size = 0
+                for _ in range(repeats):
+                    size = 0
+                    started = time.perf_counter()
+                    for img in images:
+                        # Pillow accepts a file object in place of a path
+                        buf = io.BytesIO()
+                        save_image(img, buf, fmt=fmt, profile=profile)
+                        size += buf.tell()
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+
+                print(
+                    f"{label:<20} {len(images):>5} {fmt:<6} {profile:<9} "
+                    f"{best * 1000:>10.1f} {size:>10,}"
+                )
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,138 @@
+# bench_item_search.py
+"""
+Compares /api/items search over a synthetic catalog: the indexed search
+(shared.item_search), first page and fifth page through the cursor,
+against the old item_name ILIKE scan. Then checks that every hit of
+each query, scrolled to the end, contains all of its terms.
+
+Runs on a throw-away SQLite database, never on data/deliveries.db.
+
+Usage: python bench_item_search.py [items] [repeats]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Add the project root to the python path
+sys.path.append(os.getcwd())
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_items.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from shared.db import Base, SessionLocal, engine  # noqa: E402
+from shared.item_search import reindex_items, search_items, to_latin  # noqa: E402
+from shared.models import Item  # noqa: E402
+
+WORDS = [
+    "Кондиционер", "настенный", "инверторный", "Холодильник", "двухкамерный",
+    "Стиральная", "машина", "Пылесос", "Телевизор", "Шампунь", "Сок",
+    "Samsung", "Artel", "LG", "Shivaki", "Premier", "Xiaomi", "Coca-Cola",
+    "muzlatgich", "konditsioner", "changyutgich", "sovutgich", "qozon",
+]
+
+QUERIES = [
+    "кондиционер",   # Cyrillic, also matches "konditsioner"
+    "konditsioner",  # Latin, also matches "Кондиционер"
+    "holodilnik",    # Latin spelling of a Cyrillic-only word
+    "samsung 123",   # two terms
+    "samsung 12",    # a term shorter than a trigram
+    "сок 1",
+    "xiaomi",
+    "шампунь",
+    "zzzznotfound",
+]
+
+
+def build_catalog(size: int):
+    Base.metadata.create_all(bind=engine)
+    rnd = random.Random(1)
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(Item, [
+            {
+                "item_code": f"A{i:06d}",
+                "item_name": " ".join(rnd.sample(WORDS, 3)) + f" {i}",
+                "quantity": rnd.randint(0, 50),
+                "price": rnd.randint(1, 100) * 10_000,
+                "currency": "UZS",
+            }
+            for i in range(size)
+        ])
+        reindex_items(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+def timed(run, repeats: int) -> tuple[float, float, int]:
+    samples = []
+    rows = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        rows = len(run())
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1], rows
+
+
+def bench(size: int, repeats: int):
+    started = time.perf_counter()
+    build_catalog(size)
+    print(f"catalog: {size:,} items, built in {time.perf_counter() - started:.1f}s\n")
+
+    db = SessionLocal()
+    base = db.query(Item).filter(Item.quantity > 0)
+
+    print(f"{'query':<16} {'method':<6} {'p50 ms':>8} {'p95 ms':>8} {'rows':>5}  top hit")
+    for q in QUERIES:
+        # the fifth page, reached through the keyset cursor
+        position = None
+        for _ in range(4):
+            _, position = search_items(base, q, 20, position)
+            if position is None:
+                break
+
+        fts = lambda: search_items(base, q, 20)[0]  # noqa: E731
+        page5 = lambda: search_items(base, q, 20, position)[0] if position else []  # noqa: E731
+        like = lambda: (  # noqa: E731
+            base.filter(Item.item_name.ilike(f"%{q}%"))
+            .order_by(Item.updated_at.desc()).limit(20).all()
+        )
+        for method, run in (("fts", fts), ("page5", page5), ("ilike", like)):
+            p50, p95, rows = timed(run, repeats)
+            top = run()
+            print(
+                f"{q:<16} {method:<6} {p50:>8.2f} {p95:>8.2f} {rows:>5}  "
+                f"{top[0].item_name if top else '-'}"
+            )
+
+    check_all_terms(base)
+    db.close()
+
+
+def check_all_terms(base):
+    """Every hit of a query contains every term, short ones included."""
+    print()
+    for q in QUERIES:
+        terms = to_latin(q).split()
+        position, hits, misses = None, 0, 0
+        while True:
+            page, position = search_items(base, q, 100, position)
+            hits += len(page)
+            misses += sum(
+                not all(t in to_latin(item.item_name) for t in terms)
+                for item in page
+            )
+            if position is None:
+                break
+        print(f"{q:<16} {hits:>6} hits, {'ok' if not misses else f'{misses} missing a term'}")
+
+
+if __name__ == "__main__":
+    bench(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    )
@@ -0,0 +1,167 @@
+# bench_pagination.py
+"""
+Queries and rows transferred per page of /api/history and /api/items,
+with the child rows (delivery lines, item images) eager-loaded the old
+way (joinedload, one wrapped LIMIT query with a row per child) against
+the endpoints as they are (history: page query, then the lines in one
+IN query; items: the precomputed items.image_url, no image rows at all).
+
+Runs on a throw-away SQLite database, never on data/deliveries.db.
+
+Usage: python bench_pagination.py [deliveries] [lines per delivery] [repeats]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Add the project root to the python path
+sys.path.append(os.getcwd())
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_pagination.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from fastapi import Response  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.orm import joinedload  # noqa: E402
+
+from api.main import get_history, get_items  # noqa: E402
+from shared.db import Base, SessionLocal, engine  # noqa: E402
+from shared.models import Delivery, DeliveryItem, Item, ItemImage, TelegramUser  # noqa: E402
+
+CARD_CODE = "C00001"
+PAGE = 20
+IMAGES_PER_ITEM = 4
+
+
+def build(deliveries: int, lines: int):
+    Base.metadata.create_all(bind=engine)
+    rnd = random.Random(1)
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(Delivery, [
+            {
+                "id": d,
+                "card_code": CARD_CODE,
+                "doc_entry": d,
+                "document_number": str(100000 + d),
+                "date": f"2026-{d % 12 + 1:02d}-{d % 28 + 1:02d}",
+                "remarks": "remarks " * 8,
+                "document_total_amount": rnd.randint(1, 1000) * 10_000,
+                "currency": "UZS",
+            }
+            for d in range(1, deliveries + 1)
+        ])
+        db.bulk_insert_mappings(DeliveryItem, [
+            {
+                "delivery_id": d,
+                "line_num": n,
+                "item_code": f"A{n:06d}",
+                "item_name": f"Item {n}",
+                "quantity": rnd.randint(1, 10),
+                "price": 10_000,
+                "line_total": 10_000,
+            }
+            for d in range(1, deliveries + 1)
+            for n in range(lines)
+        ])
+        db.bulk_insert_mappings(Item, [
+            {"item_code": f"A{n:06d}", "item_name": f"Item {n}", "quantity": 5, "price": 10_000}
+            for n in range(deliveries)
+        ])
+        db.bulk_insert_mappings(ItemImage, [
+            {"item_code": f"A{n:06d}", "file_path": f"images\\A{n:06d}_{i}.jpg", "is_primary": i == 0}
+            for n in range(deliveries)
+            for i in range(IMAGES_PER_ITEM)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+class StatementLog:
+    """Records the statements run on the engine while active."""
+
+    def __init__(self):
+        self.statements = []
+        self.active = False
+        event.listen(engine, "before_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active:
+            self.statements.append((statement, parameters))
+
+    def transferred(self) -> tuple[int, int]:
+        """Rows and column values the logged SELECTs return, by running them again."""
+        rows = values = 0
+        with engine.connect() as conn:
+            for statement, parameters in self.statements:
+                for row in conn.exec_driver_sql(statement, parameters):
+                    rows += 1
+                    values += len(row)
+        return rows, values
+
+
+def measure(log: StatementLog, run, repeats: int) -> tuple[int, int, int, float]:
+    log.statements, log.active = [], True
+    run()
+    log.active = False
+    queries = len(log.statements)
+    rows, values = log.transferred()
+
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return queries, rows, values, statistics.median(samples)
+
+
+def bench(deliveries: int, lines: int, repeats: int):
+    build(deliveries, lines)
+    print(f"{deliveries:,} deliveries x {lines} lines, {IMAGES_PER_ITEM} images per item, page of {PAGE}\n")
+
+    log = StatementLog()
+    user = TelegramUser(card_code=CARD_CODE)
+
+    def fresh(run):
+        # new session per call: nothing served from the identity map
+        def wrapped():
+            db = SessionLocal()
+            try:
+                return run(db)
+            finally:
+                db.close()
+        return wrapped
+
+    cases = [
+        ("history", "joinedload", fresh(lambda db: (
+            db.query(Delivery).options(joinedload(Delivery.items))
+            .filter(Delivery.card_code == CARD_CODE)
+            .order_by(Delivery.date.desc(), Delivery.created_at.desc())
+            .limit(PAGE).all()
+        ))),
+        ("history", "endpoint", fresh(lambda db: get_history(user, db, None, PAGE, None, False))),
+        ("items", "joinedload", fresh(lambda db: (
+            db.query(Item).options(joinedload(Item.images))
+            .filter(Item.quantity > 0)
+            .order_by(Item.updated_at.desc())
+            .limit(PAGE).all()
+        ))),
+        ("items", "endpoint", fresh(lambda db: get_items(Response(), None, PAGE, None, db))),
+    ]
+
+    print(f"{'endpoint':<9} {'loading':<11} {'queries':>7} {'rows':>7} {'values':>8} {'p50 ms':>8}")
+    for endpoint, loading, run in cases:
+        queries, rows, values, p50 = measure(log, run, repeats)
+        print(f"{endpoint:<9} {loading:<11} {queries:>7} {rows:>7} {values:>8} {p50:>8.2f}")
+
+
+if __name__ == "__main__":
+    bench(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 2_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 300,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    )
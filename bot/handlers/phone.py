@@ -1,6 +1,10 @@
+import asyncio
+import datetime
+
 from aiogram import types, F
 from sqlalchemy.orm import Session
 
+from bot.keyboards import webapp_keyboard
 from shared.db import SessionLocal
 from shared.models import TelegramUser
 from bot.sap_bp import find_bp_by_phone, normalize_phone
@@ -15,6 +19,13 @@ async def phone_handler(message: types.Message):
 
     phone = normalize_phone(contact.phone_number)
 
+    try:
+        # snapshot lookup, kept off the bot event loop
+        bp = await asyncio.to_thread(find_bp_by_phone, phone)
+    except Exception as e:
+        print("BP lookup error:", e)
+        bp = None  # bp_sync_loop will pick the user up
+
     db = SessionLocal()
     try:
         user = db.query(TelegramUser).filter(
@@ -27,13 +38,26 @@ async def phone_handler(message: types.Message):
 
         user.phone_number = phone
         user.phone_verified = True
-        user.is_active = False  # WAIT for BP sync
+
+        if bp:
+            user.card_code, user.card_name = bp
+            user.is_active = True
+            user.last_sap_sync = datetime.datetime.utcnow()
+        else:
+            user.is_active = False  # WAIT for BP sync
 
         db.commit()
 
     finally:
         db.close()
 
+    if bp:
+        await message.answer(
+            "✅ Откройте панель отгрузок:",
+            reply_markup=webapp_keyboard
+        )
+        return
+
     await message.answer(
         "✅ Phone saved. Your account will be activated after verification."
     )
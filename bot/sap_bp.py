@@ -1,16 +1,27 @@
-def normalize_phone(phone: str) -> str:
-    return phone.replace(" ", "").replace("-", "").replace("+", "")
+from shared.business_partners import resolve_phone
+from shared.db import SessionLocal
+from shared.phones import normalize_phone
 
 
 def find_bp_by_phone(phone: str):
     """
+    Resolves an active SAP customer by phone from the local BP snapshot
+    (kept by worker/bp_sync.py).
+
     Return:
       (card_code, card_name) or None
     """
-    # TEMP MOCK
-    demo = {
-        "998901234567": ("C20000", "Demo Partner"),
-    }
+    db = SessionLocal()
+    try:
+        match = resolve_phone(db, normalize_phone(phone))
+    finally:
+        db.close()
+
+    if not match:
+        return None
+
+    card_code, bp = match
+    if bp["validFor"] != "Y":
+        return None
 
-    phone = normalize_phone(phone)
-    return demo.get(phone)
+    return card_code, bp["card_name"]
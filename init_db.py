@@ -1,11 +1,76 @@
 # shared/init_db.py
-from shared.db import engine
-from shared.models import Base
+from sqlalchemy import inspect
+
+from shared.db import SessionLocal, engine
+from shared.item_search import reindex_items
+from shared.models import Base, ITEM_IMAGE_TRIGGERS, PRIMARY_IMAGE_URL
+
+
+def upgrade_schema():
+    """
+    create_all only creates missing tables; columns added to existing
+    models are appended here with ALTER TABLE (nullable, no default),
+    their missing indexes are created and the item search index is
+    brought up to date.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+
+                col_type = column.type.compile(dialect=engine.dialect)
+                print(f"Adding column {table.name}.{column.name} ({col_type})")
+                conn.exec_driver_sql(
+                    f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'
+                )
+
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    print(f"Creating index {index.name}")
+                    index.create(conn)
+
+    # search works from the first start, not only after the worker's
+    # item sync; unchanged keys are not rewritten
+    db = SessionLocal()
+    try:
+        print(f"Indexed {reindex_items(db)} items for search")
+        db.commit()
+    finally:
+        db.close()
+
+
+def install_image_url_triggers():
+    """
+    Adds the items.image_url triggers to an item_images table created
+    before them, and fills image_url for the images it already holds.
+    """
+    with engine.begin() as conn:
+        installed = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'item_images_url_ai'"
+        ).first()
+        if installed:
+            return
+
+        print("Creating item_images triggers, backfilling items.image_url")
+        for ddl in ITEM_IMAGE_TRIGGERS:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql(f"UPDATE items SET image_url = {PRIMARY_IMAGE_URL}")
 
 
 def init_db():
     print("DATABASE_URL =", engine.url)
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+    install_image_url_triggers()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+# shared/business_partners.py
+import datetime
+
+from shared.hana import SL_COMPANYDB
+from shared.models import BusinessPartner, BusinessPartnerPhone
+from shared.phones import build_phone_index, normalize_phone
+
+PARTNERS_QUERY = f"""
+    SELECT
+        "CardCode",
+        "CardName",
+        "Cellular",
+        "Phone1",
+        "Phone2",
+        "validFor",
+        "UpdateDate",
+        "UpdateTS"
+    FROM "{SL_COMPANYDB}"."OCRD"
+    WHERE "CardType" = 'C'
+"""
+
+
+def read_partners(cursor) -> dict:
+    """Maps PARTNERS_QUERY rows to {card_code: partner} dicts."""
+    result = {}
+    for (card_code, card_name, cellular, phone1, phone2, valid_for,
+         update_date, update_ts) in cursor.fetchall():
+        result[card_code] = {
+            "card_name": card_name,
+            "phones": [p for p in (cellular, phone1, phone2) if p],
+            "validFor": valid_for,
+            "update_date": str(update_date)[:10] if update_date else None,
+            "update_ts": update_ts
+        }
+    return result
+
+
+def save_snapshot(db, partners: dict, full: bool = False):
+    """
+    Upserts `partners` into the local business_partners snapshot.
+    A full load also drops partners that no longer exist in SAP.
+    """
+    card_codes = list(partners)
+
+    if full:
+        db.query(BusinessPartnerPhone).delete()
+        db.query(BusinessPartner).filter(
+            BusinessPartner.card_code.notin_(card_codes)
+        ).delete(synchronize_session=False)
+    elif card_codes:
+        db.query(BusinessPartnerPhone).filter(
+            BusinessPartnerPhone.card_code.in_(card_codes)
+        ).delete(synchronize_session=False)
+
+    existing = {
+        bp.card_code: bp for bp in
+        db.query(BusinessPartner).filter(BusinessPartner.card_code.in_(card_codes))
+    } if card_codes else {}
+
+    now = datetime.datetime.utcnow()
+    for card_code, data in partners.items():
+        bp = existing.get(card_code)
+        if bp is None:
+            bp = BusinessPartner(card_code=card_code)
+            db.add(bp)
+
+        bp.card_name = data["card_name"]
+        bp.valid_for = data["validFor"]
+        bp.update_date = data["update_date"]
+        bp.update_ts = data["update_ts"]
+        bp.synced_at = now
+
+    db.add_all(
+        BusinessPartnerPhone(phone=phone, card_code=card_code)
+        for card_code, data in partners.items()
+        for phone in {normalize_phone(p) for p in data["phones"]} - {""}
+    )
+    db.flush()
+
+
+def snapshot_index(db, phones: set[str]) -> tuple[dict[str, str], dict]:
+    """
+    Resolves `phones` against the local snapshot.
+    Returns (phone -> card_code index, partners) in the same shape as
+    build_phone_index / read_partners.
+    """
+    phones = set(phones) - {""}
+    if not phones:
+        return {}, {}
+
+    partners = {}
+    for phone, bp in (
+        db.query(BusinessPartnerPhone.phone, BusinessPartner)
+          .join(BusinessPartner)
+          .filter(BusinessPartnerPhone.phone.in_(phones))
+    ):
+        partner = partners.setdefault(bp.card_code, {
+            "card_name": bp.card_name,
+            "phones": [],
+            "validFor": bp.valid_for
+        })
+        partner["phones"].append(phone)
+
+    return build_phone_index(partners), partners
+
+
+def resolve_phone(db, phone: str) -> tuple[str, dict] | None:
+    """
+    Point lookup of one phone in the local snapshot, an indexed
+    business_partner_phones read. OCRD has no index a phone search could
+    use, so SAP isn't asked: partners added there since the last delta
+    run are matched by the next one (worker/bp_sync.py).
+
+    :return: (card_code, partner) or None
+    """
+    phone = normalize_phone(phone)
+
+    index, partners = snapshot_index(db, {phone})
+    card_code = index.get(phone)
+    return (card_code, partners[card_code]) if card_code else None
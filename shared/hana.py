@@ -0,0 +1,207 @@
+# shared/hana.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable
+
+# --- HANA connection settings ---
+HANA_HOST = os.getenv("HANA_HOST", "hana_host")
+HANA_PORT = int(os.getenv("HANA_PORT", 30015))
+HANA_USER = os.getenv("HANA_USER", "username")
+HANA_PASSWORD = os.getenv("HANA_PASSWORD", "password")
+SL_COMPANYDB = os.getenv("SL_COMPANYDB", "CompanyDB")
+
+# hdbcli | sqlite (local stand-in, see standin_connect)
+HANA_DRIVER = os.getenv("HANA_DRIVER", "hdbcli")
+HANA_STANDIN_PATH = os.getenv("HANA_STANDIN_PATH", ":memory:")
+
+HANA_POOL_SIZE = int(os.getenv("HANA_POOL_SIZE", 4))
+HANA_POOL_TIMEOUT = float(os.getenv("HANA_POOL_TIMEOUT", 30))  # seconds
+HANA_POOL_IDLE_TIMEOUT = float(os.getenv("HANA_POOL_IDLE_TIMEOUT", 600))
+HANA_POOL_PING_AFTER = float(os.getenv("HANA_POOL_PING_AFTER", 30))
+
+# Cached statement cursors per connection
+STATEMENT_CACHE_SIZE = 32
+
+
+def hdbcli_connect():
+    from hdbcli import dbapi
+
+    return dbapi.connect(
+        address=HANA_HOST,
+        port=HANA_PORT,
+        user=HANA_USER,
+        password=HANA_PASSWORD
+    )
+
+
+def standin_connect(path: str = HANA_STANDIN_PATH):
+    """
+    Local stand-in for HANA: an SQLite database attached under the
+    SL_COMPANYDB schema name, so `"<CompanyDB>"."ODLN"` style queries
+    and `?` parameters work unchanged. Tables are created by the caller.
+    """
+    conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+    conn.execute("ATTACH DATABASE ? AS ?", (path, SL_COMPANYDB))
+    conn.execute('CREATE TABLE IF NOT EXISTS temp."DUMMY" ("DUMMY" TEXT)')
+    conn.execute("""INSERT INTO temp."DUMMY" VALUES ('X')""")
+    return conn
+
+
+DRIVERS = {
+    "hdbcli": hdbcli_connect,
+    "sqlite": standin_connect,
+}
+
+
+class PooledConnection:
+    """A pooled DB-API connection plus its per-SQL cursor cache."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.last_used = time.monotonic()
+        self._statements: OrderedDict[str, object] = OrderedDict()
+
+    def cursor(self):
+        return self.raw.cursor()
+
+    def statement(self, sql: str):
+        """
+        Returns a cursor dedicated to `sql`, kept for the life of the
+        connection so the driver can reuse its prepared statement.
+        Don't close it; it is closed with the connection.
+        """
+        cursor = self._statements.pop(sql, None)
+        if cursor is None:
+            cursor = self.raw.cursor()
+            if len(self._statements) >= STATEMENT_CACHE_SIZE:
+                _, oldest = self._statements.popitem(last=False)
+                _close_quietly(oldest)
+        self._statements[sql] = cursor
+        return cursor
+
+    def ping(self) -> bool:
+        try:
+            cursor = self.raw.cursor()
+            try:
+                cursor.execute('SELECT 1 FROM "DUMMY"')
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        for cursor in self._statements.values():
+            _close_quietly(cursor)
+        self._statements.clear()
+        _close_quietly(self.raw)
+
+
+def _close_quietly(obj):
+    try:
+        obj.close()
+    except Exception:
+        pass
+
+
+class HanaPool:
+    """
+    Bounded, thread-safe HANA connection pool.
+
+    Idle connections are evicted after `idle_timeout` seconds and pinged
+    before reuse when they sat idle longer than `ping_after`.
+    """
+
+    def __init__(
+        self,
+        connect: Callable | None = None,
+        max_size: int = HANA_POOL_SIZE,
+        timeout: float = HANA_POOL_TIMEOUT,
+        idle_timeout: float = HANA_POOL_IDLE_TIMEOUT,
+        ping_after: float = HANA_POOL_PING_AFTER
+    ):
+        self.connect = connect or DRIVERS[HANA_DRIVER]
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle: deque[PooledConnection] = deque()
+        self._lock = threading.Lock()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            stale = [c for c in self._idle if now - c.last_used > self.idle_timeout]
+            for conn in stale:
+                self._idle.remove(conn)
+        for conn in stale:
+            conn.close()
+
+    def _checkout(self) -> PooledConnection:
+        self._evict_idle()
+
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+
+            if conn is None:
+                return PooledConnection(self.connect())
+
+            if time.monotonic() - conn.last_used < self.ping_after or conn.ping():
+                return conn
+
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("HANA pool exhausted")
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        try:
+            yield conn
+        except BaseException:
+            # errors and abandoned generators (GeneratorExit) may leave
+            # pending results behind, so the connection is not reused
+            conn.close()
+            raise
+        else:
+            conn.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            conn.close()
+
+
+_pool: HanaPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_hana_pool() -> HanaPool:
+    """Process-wide pool shared by all HANA readers."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HanaPool()
+        return _pool
+
+
+def hana_connection():
+    """`with hana_connection() as conn:` on the shared pool."""
+    return get_hana_pool().connection()
@@ -1,4 +1,6 @@
 from datetime import datetime
+import hashlib
+import json
 
 from PIL import Image, ImageDraw, ImageFont
 import os
@@ -6,10 +8,98 @@ from shared.config import DATA_DIR
 
 FONTS_DIR = os.path.join(DATA_DIR, "fonts")
 FONT_REGULAR = os.path.join(FONTS_DIR, "arial.ttf")
-FONT_BOLD = os.path.join(FONTS_DIR, "G_ari_bd.ttf")
+FONT_BOLD = os.path.join(FONTS_DIR, "G_ari_bd.TTF")
 
 CELL_PADDING = 8
 
+# Word-width memo is cleared once it grows past this many entries
+WIDTH_CACHE_LIMIT = 50_000
+
+# Paginated mode: upper bound for one page, header and footer included
+PAGE_MAX_HEIGHT = int(os.getenv("RENDER_PAGE_MAX_HEIGHT", 2400))
+
+# Output encoding: png | png8 (palette-quantized) | jpeg | webp
+IMAGE_FORMAT = os.getenv("RENDER_IMAGE_FORMAT", "png8")
+# Size/latency trade-off: fast | balanced | small
+ENCODE_PROFILE = os.getenv("RENDER_ENCODE_PROFILE", "balanced")
+
+# format -> (file extension, Pillow format, save options per profile)
+ENCODERS = {
+    "png": (".png", "PNG", {
+        "fast": {"compress_level": 1},
+        "balanced": {"compress_level": 6},
+        "small": {"compress_level": 9, "optimize": True},
+    }),
+    "png8": (".png", "PNG", {
+        "fast": {"compress_level": 1},
+        "balanced": {"compress_level": 6},
+        "small": {"compress_level": 9, "optimize": True},
+    }),
+    "jpeg": (".jpg", "JPEG", {
+        "fast": {"quality": 85},
+        "balanced": {"quality": 85, "optimize": True},
+        "small": {"quality": 75, "optimize": True, "progressive": True},
+    }),
+    "webp": (".webp", "WEBP", {
+        "fast": {"quality": 80, "method": 0},
+        "balanced": {"quality": 80, "method": 4},
+        "small": {"quality": 75, "method": 6},
+    }),
+}
+
+# Invoices are black/grey text on white, 16 shades keep the anti-aliasing
+PALETTE_COLORS = 16
+
+WIDTH = 1000
+ROW_HEIGHT = 45
+HEADER_HEIGHT = 280
+FOOTER_HEIGHT = 140
+
+TABLE_LEFT = 40
+TABLE_RIGHT = WIDTH - 40
+
+COLS = {
+    "idx": 40,
+    "code": 100,
+    "desc": 260,
+    "qty": 600,
+    "price": 700,
+    "total": 820,
+}
+
+HEADERS = [
+    ("#", "idx", "code"),
+    ("Артикул", "code", "desc"),
+    ("Название товара", "desc", "qty"),
+    ("Кол-во", "qty", "price"),
+    ("Цена", "price", "total"),
+    ("Сумма", "total", None),
+]
+
+DESC_WIDTH = COLS["qty"] - COLS["desc"] - CELL_PADDING * 2
+
+
+def image_ext(fmt: str | None = None) -> str:
+    return ENCODERS[fmt or IMAGE_FORMAT][0]
+
+
+def save_image(
+    img: Image.Image,
+    path: str,
+    fmt: str | None = None,
+    profile: str | None = None
+) -> str:
+    """Encodes `img` to `path` with the configured format and profile."""
+    fmt = fmt or IMAGE_FORMAT
+    _, pil_format, profiles = ENCODERS[fmt]
+    options = profiles[profile or ENCODE_PROFILE]
+
+    if fmt == "png8":
+        img = img.quantize(colors=PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+
+    img.save(path, format=pil_format, **options)
+    return path
+
 
 def get_font(size: int, bold: bool = False):
     try:
@@ -20,178 +110,283 @@ def get_font(size: int, bold: bool = False):
         return ImageFont.load_default()
 
 
-def wrap_text(draw, text, font, max_width):
-    words = str(text).split()
-    lines = []
-    current = ""
-
-    for word in words:
-        test = current + (" " if current else "") + word
-        if draw.textbbox((0, 0), test, font=font)[2] <= max_width:
-            current = test
-        else:
-            lines.append(current)
-            current = word
-
-    if current:
-        lines.append(current)
+class DeliveryRenderer:
+    """
+    Keeps fonts loaded for the life of the process and memoizes text
+    widths, so a render is one layout computation plus one draw.
+    """
+
+    def __init__(self):
+        self.fonts = {
+            "title": get_font(42),
+            "header": get_font(28, bold=True),
+            "normal": get_font(24),
+            "bold": get_font(26, bold=True),
+            "small": get_font(20),
+        }
+        self.line_h = self.fonts["normal"].getbbox("Ag")[3] + 4
+        self._widths: dict[tuple[str, str], float] = {}
+
+    def text_width(self, text: str, font: str = "normal") -> float:
+        key = (font, text)
+        width = self._widths.get(key)
+
+        if width is None:
+            if len(self._widths) >= WIDTH_CACHE_LIMIT:
+                self._widths.clear()
+            width = self.fonts[font].getlength(text)
+            self._widths[key] = width
+
+        return width
+
+    def wrap_text(self, text, max_width: float, font: str = "normal") -> list[str]:
+        space = self.text_width(" ", font)
+        lines = []
+        current: list[str] = []
+        current_w = 0.0
+
+        for word in str(text).split():
+            w = self.text_width(word, font)
+            test_w = current_w + space + w if current else w
+
+            if test_w <= max_width or not current:
+                current.append(word)
+                current_w = test_w
+            else:
+                lines.append(" ".join(current))
+                current = [word]
+                current_w = w
+
+        if current:
+            lines.append(" ".join(current))
+
+        return lines
+
+    def layout(self, items: list[dict]) -> list[tuple[list[str], int]]:
+        """Returns (description lines, row height) per item."""
+        rows = []
+        for item in items:
+            lines = self.wrap_text(item.get("item_name", "-"), DESC_WIDTH)
+            rows.append((lines, max(ROW_HEIGHT, len(lines) * self.line_h)))
+        return rows
+
+    def draw_right(self, draw, text: str, right: int, y: int, font: str = "normal"):
+        w = self.text_width(text, font)
+        draw.text((right - w, y), text, font=self.fonts[font], fill="black")
+
+    def center_text(self, draw, text: str, left: int, right: int, y: int, font: str):
+        w = self.text_width(text, font)
+        x = left + ((right - left) - w) // 2
+        draw.text((x, y), text, font=self.fonts[font], fill="black")
+
+    def paginate(self, rows: list[tuple[list[str], int]]) -> list[tuple[int, int]]:
+        """Splits rows into [start, end) ranges that fit PAGE_MAX_HEIGHT."""
+        available = PAGE_MAX_HEIGHT - HEADER_HEIGHT - ROW_HEIGHT - FOOTER_HEIGHT
+        pages = []
+        start = 0
+        used = 0
+
+        for i, (_, row_h) in enumerate(rows):
+            if used and used + row_h > available:
+                pages.append((start, i))
+                start = i
+                used = 0
+            used += row_h
+
+        pages.append((start, len(rows)))
+        return pages
+
+    def draw_page(
+        self,
+        delivery: dict,
+        items: list[dict],
+        rows: list[tuple[list[str], int]],
+        first_index: int = 1,
+        page: int = 1,
+        page_count: int = 1
+    ) -> Image.Image:
+        fonts = self.fonts
+
+        table_height = sum(row_h for _, row_h in rows)
+        height = HEADER_HEIGHT + ROW_HEIGHT + table_height + FOOTER_HEIGHT
+        img = Image.new("RGB", (WIDTH, height), "white")
+        draw = ImageDraw.Draw(img)
+
+        # ─── HEADER ───────────────────────────
+        y = 30
+        draw.text((40, y), "НАКЛАДНАЯ - ОТГРУЗКА", font=fonts["title"], fill="black")
+        if page_count > 1:
+            self.draw_right(draw, f"Стр. {page}/{page_count}", TABLE_RIGHT, y + 12, "small")
+        y += 70
+
+        draw.text((40, y), f"No: {delivery.get('document_number', '-')}", font=fonts["header"], fill="black")
+
+        doc_date = datetime.strptime(delivery.get('date', '-'), "%Y-%m-%d %H:%M:%S")
+        draw.text((620, y), f"Дата: {doc_date.strftime('%d.%m.%Y')}", font=fonts["header"], fill="black")
+        y += 50
+
+        draw.text((40, y), f"Клиент: {delivery.get('card_name') or '-'}", font=fonts["normal"], fill="black")
+        y += 40
+        draw.text((40, y), f"Код: {delivery.get('card_code', '-')}", font=fonts["normal"], fill="black")
+        y += 40
+        draw.text((40, y), f"Менеджер: {delivery.get('sales_manager', '-')}", font=fonts["normal"], fill="black")
+        y += 60
+
+        table_top = y
+
+        # ─── TABLE HEADER ─────────────────────
+        for text, left_key, right_key in HEADERS:
+            left = COLS[left_key]
+            right = COLS[right_key] if right_key else TABLE_RIGHT
+            self.center_text(draw, text, left, right, y, "bold")
+
+        y += ROW_HEIGHT
+        draw.line((TABLE_LEFT, y, TABLE_RIGHT, y), fill="black", width=2)
+
+        # ─── TABLE ROWS ───────────────────────
+        font_normal = fonts["normal"]
+        for i, (item, (desc_lines, row_h)) in enumerate(zip(items, rows), first_index):
+            start_y = y
+
+            draw.text((COLS["idx"] + CELL_PADDING, start_y + 8), str(i), font=font_normal, fill="black")
+            draw.text((COLS["code"] + CELL_PADDING, start_y + 8), str(item.get("item_code", "-")), font=font_normal, fill="black")
+
+            for j, line in enumerate(desc_lines):
+                draw.text(
+                    (COLS["desc"] + CELL_PADDING, start_y + 8 + j * self.line_h),
+                    line,
+                    font=font_normal,
+                    fill="black"
+                )
+
+            qty = str(item.get("quantity", 0))
+            self.draw_right(draw, qty, COLS["price"] - CELL_PADDING, start_y + 8)
+
+            price = f"{float(item.get('price', 0)):,.2f}"
+            self.draw_right(draw, price, COLS["total"] - CELL_PADDING, start_y + 8)
+
+            total = f"{float(item.get('line_total', 0)):,.2f}"
+            self.draw_right(draw, total, TABLE_RIGHT - CELL_PADDING, start_y + 8)
+
+            y += row_h
+            draw.line((TABLE_LEFT, y, TABLE_RIGHT, y), fill="#cccccc", width=1)
+
+        table_bottom = y
+
+        # ─── VERTICAL GRID LINES ──────────────
+        for x in [COLS["idx"], COLS["code"], COLS["desc"], COLS["qty"], COLS["price"], COLS["total"], TABLE_RIGHT]:
+            draw.line((x, table_top, x, table_bottom), fill="#999999", width=1)
+
+        # ─── FOOTER ───────────────────────────
+        y += 40
+        if page < page_count:
+            self.draw_right(draw, f"Продолжение на стр. {page + 1}", TABLE_RIGHT, y, "small")
+            return img
+
+        total_text = f"Всего: {delivery.get('total_amount', 0):,.2f} {delivery.get('currency', 'UZS')}"
+        self.draw_right(draw, total_text, TABLE_RIGHT, y, "bold")
+
+        y += 50
+        draw.text((40, y), f"Примечание: {delivery.get('remarks') or '-'}", font=fonts["small"], fill="black")
+
+        return img
+
+    def render(self, delivery: dict, path: str | None = None) -> str:
+        """Renders the whole delivery into one canvas."""
+        images_dir = os.path.join(DATA_DIR, "images")
+        os.makedirs(images_dir, exist_ok=True)
+
+        items = delivery.get("items", [])
+        img = self.draw_page(delivery, items, self.layout(items))
+
+        if path is None:
+            doc_num = delivery.get("document_number", "unknown")
+            path = os.path.join(images_dir, f"delivery_{doc_num}{image_ext()}")
+
+        return save_image(img, path)
+
+    def render_pages(self, delivery: dict, path_prefix: str) -> list[str]:
+        """
+        Renders the delivery as fixed-height pages with repeated headers.
+        Only one page is held in memory at a time.
 
-    return lines
+        :return: page paths, "<path_prefix><ext>" for a single page,
+                 "<path_prefix>_p<n><ext>" otherwise
+        """
+        os.makedirs(os.path.dirname(path_prefix), exist_ok=True)
 
+        items = delivery.get("items", [])
+        rows = self.layout(items)
+        pages = self.paginate(rows)
 
-def calculate_table_height(draw, items, font, row_height, desc_x, desc_right):
-    total = 0
-    line_h = font.getbbox("Ag")[3] + 4
-    width = desc_right - desc_x - CELL_PADDING * 2
+        paths = page_paths(path_prefix, len(pages))
+        for page, ((start, end), path) in enumerate(zip(pages, paths), 1):
+            img = self.draw_page(
+                delivery, items[start:end], rows[start:end],
+                first_index=start + 1, page=page, page_count=len(pages)
+            )
+            save_image(img, path)
 
-    for item in items:
-        lines = wrap_text(draw, item.get("item_name", "-"), font, width)
-        total += max(row_height, len(lines) * line_h)
+        return paths
 
-    return total
 
+def page_paths(path_prefix: str, page_count: int) -> list[str]:
+    if page_count == 1:
+        return [f"{path_prefix}{image_ext()}"]
+    return [f"{path_prefix}_p{n}{image_ext()}" for n in range(1, page_count + 1)]
 
-def center_text(draw, text, font, left, right, y):
-    w = draw.textbbox((0, 0), text, font=font)[2]
-    x = left + ((right - left) - w) // 2
-    draw.text((x, y), text, font=font, fill="black")
 
+_renderer: DeliveryRenderer | None = None
 
-def render_delivery_image(delivery: dict) -> str:
-    images_dir = os.path.join(DATA_DIR, "images")
-    os.makedirs(images_dir, exist_ok=True)
 
-    width = 1000
-    row_height = 45
-    header_height = 280
-    footer_height = 140
+def get_renderer() -> DeliveryRenderer:
+    """Process-wide renderer, created on first use."""
+    global _renderer
+    if _renderer is None:
+        _renderer = DeliveryRenderer()
+    return _renderer
 
-    font_title = get_font(42)
-    font_header = get_font(28, bold=True)
-    font_normal = get_font(24)
-    font_bold = get_font(26, bold=True)
-    font_small = get_font(20)
 
-    items = delivery.get("items", [])
+# Settings that change the rendered output; part of every cache key, so
+# cached pages and their Telegram file_ids aren't served after a change
+RENDER_CONFIG = {
+    "format": IMAGE_FORMAT,
+    "profile": ENCODE_PROFILE,
+    "page_max_height": PAGE_MAX_HEIGHT,
+    "palette_colors": PALETTE_COLORS,
+}
 
-    # ─── PASS 1: HEIGHT CALC ──────────────
-    tmp_img = Image.new("RGB", (width, 100), "white")
-    tmp_draw = ImageDraw.Draw(tmp_img)
 
-    table_height = calculate_table_height(
-        tmp_draw, items, font_normal, row_height, 260, 600
+def payload_hash(delivery: dict) -> str:
+    """
+    Stable hash of a delivery payload (see shared/payloads.py) and the
+    render settings it is drawn with.
+    """
+    raw = json.dumps(
+        {"delivery": delivery, "render": RENDER_CONFIG},
+        sort_keys=True, default=str, ensure_ascii=False
     )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-    height = header_height + row_height + table_height + footer_height
-    img = Image.new("RGB", (width, height), "white")
-    draw = ImageDraw.Draw(img)
-
-    # ─── HEADER ───────────────────────────
-    y = 30
-    draw.text((40, y), "НАКЛАДНАЯ - ОТГРУЗКА", font=font_title, fill="black")
-    y += 70
-
-    draw.text((40, y), f"No: {delivery.get('document_number', '-')}", font=font_header, fill="black")
-
-    doc_date = datetime.strptime(delivery.get('date', '-'), "%Y-%m-%d %H:%M:%S")
-    draw.text((620, y), f"Дата: {doc_date.strftime('%d.%m.%Y')}", font=font_header, fill="black")
-    y += 50
-
-    draw.text((40, y), f"Клиент: {delivery.get('card_name') or '-'}", font=font_normal, fill="black")
-    y += 40
-    draw.text((40, y), f"Код: {delivery.get('card_code', '-')}", font=font_normal, fill="black")
-    y += 40
-    draw.text((40, y), f"Менеджер: {delivery.get('sales_manager', '-')}", font=font_normal, fill="black")
-    y += 60
-
-    # ─── TABLE DEFINITIONS ────────────────
-    TABLE_LEFT = 40
-    TABLE_RIGHT = width - 40
-
-    COLS = {
-        "idx": 40,
-        "code": 100,
-        "desc": 260,
-        "qty": 600,
-        "price": 700,
-        "total": 820,
-    }
-
-    HEADERS = [
-        ("#", "idx", "code"),
-        ("Артикул", "code", "desc"),
-        ("Название товара", "desc", "qty"),
-        ("Кол-во", "qty", "price"),
-        ("Цена", "price", "total"),
-        ("Сумма", "total", None),
-    ]
-
-    table_top = y
-
-    # ─── TABLE HEADER ─────────────────────
-    for text, left_key, right_key in HEADERS:
-        left = COLS[left_key]
-        right = COLS[right_key] if right_key else TABLE_RIGHT
-        center_text(draw, text, font_bold, left, right, y)
-
-    y += row_height
-    draw.line((TABLE_LEFT, y, TABLE_RIGHT, y), fill="black", width=2)
-
-    # ─── TABLE ROWS ───────────────────────
-    for i, item in enumerate(items, 1):
-        start_y = y
-
-        desc_width = COLS["qty"] - COLS["desc"] - CELL_PADDING * 2
-        desc_lines = wrap_text(
-            draw, item.get("item_name", "-"), font_normal, desc_width
-        )
-
-        line_h = font_normal.getbbox("Ag")[3] + 4
-        row_h = max(row_height, len(desc_lines) * line_h)
-
-        draw.text((COLS["idx"] + CELL_PADDING, start_y + 8), str(i), font=font_normal, fill="black")
-        draw.text((COLS["code"] + CELL_PADDING, start_y + 8), str(item.get("item_code", "-")), font=font_normal, fill="black")
-
-        for j, line in enumerate(desc_lines):
-            draw.text(
-                (COLS["desc"] + CELL_PADDING, start_y + 8 + j * line_h),
-                line,
-                font=font_normal,
-                fill="black"
-            )
-
-        qty = str(item.get("quantity", 0))
-        w = draw.textbbox((0, 0), qty, font=font_normal)[2]
-        draw.text((COLS["price"] - CELL_PADDING - w, start_y + 8), qty, font=font_normal, fill="black")
 
-        price = f"{float(item.get('price', 0)):,.2f}"
-        w = draw.textbbox((0, 0), price, font=font_normal)[2]
-        draw.text((COLS["total"] - CELL_PADDING - w, start_y + 8), price, font=font_normal, fill="black")
-
-        total = f"{float(item.get('line_total', 0)):,.2f}"
-        w = draw.textbbox((0, 0), total, font=font_normal)[2]
-        draw.text((TABLE_RIGHT - CELL_PADDING - w, start_y + 8), total, font=font_normal, fill="black")
-
-        y += row_h
-        draw.line((TABLE_LEFT, y, TABLE_RIGHT, y), fill="#cccccc", width=1)
-
-    table_bottom = y
+def render_delivery_pages_cached(delivery: dict, key: str | None = None) -> list[str]:
+    """
+    Renders the delivery pages once per distinct payload.
+    Pages are stored under the payload hash and reused while they exist.
+    """
+    key = key or payload_hash(delivery)
+    doc_num = delivery.get("document_number", "unknown")
+    prefix = os.path.join(DATA_DIR, "images", f"delivery_{doc_num}_{key[:16]}")
 
-    # ─── VERTICAL GRID LINES ──────────────
-    for x in [COLS["idx"], COLS["code"], COLS["desc"], COLS["qty"], COLS["price"], COLS["total"], TABLE_RIGHT]:
-        draw.line((x, table_top, x, table_bottom), fill="#999999", width=1)
+    renderer = get_renderer()
+    page_count = len(renderer.paginate(renderer.layout(delivery.get("items", []))))
+    paths = page_paths(prefix, page_count)
 
-    # ─── FOOTER ───────────────────────────
-    y += 40
-    total_text = f"Всего: {delivery.get('total_amount', 0):,.2f} {delivery.get('currency', 'UZS')}"
-    w = draw.textbbox((0, 0), total_text, font=font_bold)[2]
-    draw.text((TABLE_RIGHT - w, y), total_text, font=font_bold, fill="black")
+    if all(os.path.exists(p) for p in paths):
+        return paths
 
-    y += 50
-    draw.text((40, y), f"Примечание: {delivery.get('remarks') or '-'}", font=font_small, fill="black")
+    return renderer.render_pages(delivery, prefix)
 
-    doc_num = delivery.get("document_number", "unknown")
-    path = os.path.join(images_dir, f"delivery_{doc_num}.png")
-    img.save(path, quality=95)
 
-    return path
+def render_delivery_image(delivery: dict, path: str | None = None) -> str:
+    return get_renderer().render(delivery, path=path)
@@ -0,0 +1,201 @@
+# shared/item_search.py
+import os
+import re
+
+from sqlalchemy import and_, column, literal_column, or_, select, table, true, tuple_
+from sqlalchemy.dialects.sqlite import insert
+
+from shared.models import Item, ItemSearch
+
+# Cyrillic (Russian + Uzbek) -> Latin, close to the Uzbek Latin alphabet
+CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "j", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "i", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+    "ў": "o", "қ": "q", "ғ": "g", "ҳ": "h",
+}
+TRANSLIT_TABLE = str.maketrans(CYRILLIC_TO_LATIN)
+
+# Spellings that differ between typists of the same word
+LATIN_FOLDS = (("kh", "h"), ("x", "h"), ("zh", "j"))
+
+NON_WORD = re.compile(r"[^\w\s]+")
+
+# Shortest term the trigram index can look up
+MIN_TERM_LENGTH = 3
+
+# Rows of the rank index checked directly before search turns to the
+# FTS hits, see substring_hits
+SCAN_WINDOW = int(os.getenv("ITEM_SEARCH_SCAN_WINDOW", 500))
+
+# Search cursor phases: names starting with the query, then the rest
+PREFIX, SUBSTRING = 0, 1
+
+items_fts = table("items_fts", column("rowid"))
+
+
+def to_latin(value: str) -> str:
+    """
+    Search key of a name or query: lower case, Cyrillic transliterated,
+    punctuation (o', g' apostrophes included) dropped, spelling variants folded.
+    """
+    key = (value or "").lower().translate(TRANSLIT_TABLE)
+    key = NON_WORD.sub("", key)
+    for variant, folded in LATIN_FOLDS:
+        key = key.replace(variant, folded)
+    return " ".join(key.split())
+
+
+def index_items(db, rows: list[dict]):
+    """Upserts the search keys of `rows` (dicts with item_code, item_name)."""
+    if not rows:
+        return
+
+    stmt = insert(ItemSearch)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ItemSearch.item_code],
+        set_={"name_latin": stmt.excluded.name_latin, "name_len": stmt.excluded.name_len},
+        # unchanged names don't rewrite the FTS index; rows indexed
+        # before name_len existed get it filled in
+        where=or_(
+            ItemSearch.name_latin != stmt.excluded.name_latin,
+            ItemSearch.name_len.is_(None)
+        )
+    )
+    keys = [(r["item_code"], to_latin(r["item_name"])) for r in rows]
+    db.execute(stmt, [
+        {"item_code": code, "name_latin": name, "name_len": len(name)}
+        for code, name in keys
+    ])
+
+
+def reindex_items(db, batch_size: int = 1000) -> int:
+    """Indexes every item; rows of deleted items are dropped."""
+    db.query(ItemSearch).filter(
+        ItemSearch.item_code.notin_(select(Item.item_code))
+    ).delete(synchronize_session=False)
+
+    total = 0
+    rows = db.execute(select(Item.item_code, Item.item_name)).mappings()
+    while batch := rows.fetchmany(batch_size):
+        index_items(db, [dict(r) for r in batch])
+        total += len(batch)
+    return total
+
+
+def indexed_terms(key: str) -> list[str]:
+    """Terms of a search key long enough for the trigram index."""
+    return [t for t in key.split() if len(t) >= MIN_TERM_LENGTH]
+
+
+def match_expression(q: str) -> str | None:
+    """
+    FTS5 MATCH string for `q`: every term of 3+ characters must occur
+    as a substring. None when the query has no such term.
+    """
+    terms = indexed_terms(to_latin(q))
+    if not terms:
+        return None
+    return " AND ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def search_items(query, q: str, limit: int, position: tuple | None = None):
+    """
+    One page of matches of `q` in an Item query, best first, and the
+    position of its last row (None on the last page).
+
+    Names starting with the query come first, in name order, from a range
+    scan of ix_item_search_prefix. The other matches follow, shortest
+    name first, in ix_item_search_len_code order. A position is
+    (phase, name_latin, item_code) of a row, every step is a keyset seek.
+    """
+    key = to_latin(q)
+    query = (
+        query.join(ItemSearch, ItemSearch.item_code == Item.item_code)
+        .add_columns(ItemSearch.name_latin)
+    )
+    prefix = prefix_filter(key)
+    phase, after = (position[0], position[1:]) if position else (PREFIX, None)
+
+    hits = []
+    if phase == PREFIX:
+        name_code = (ItemSearch.name_latin, ItemSearch.item_code)
+        prefix_hits = query.filter(prefix)
+        if after:
+            prefix_hits = prefix_hits.filter(tuple_(*name_code) > tuple_(*after))
+        hits = [
+            (PREFIX, row)
+            for row in prefix_hits.order_by(*name_code).limit(limit + 1).all()
+        ]
+        after = None
+
+    # an empty key makes every name a prefix hit
+    if len(hits) <= limit and key:
+        hits += [
+            (SUBSTRING, row)
+            for row in substring_hits(query, key, ~prefix, after, limit + 1 - len(hits))
+        ]
+
+    page = [row.Item for _, row in hits[:limit]]
+    if len(hits) <= limit:
+        return page, None
+    phase, last = hits[limit - 1]
+    return page, (phase, last.name_latin, last.Item.item_code)
+
+
+def prefix_filter(key: str):
+    """name_latin starts with `key`, as a range ix_item_search_prefix can seek."""
+    if not key:
+        return true()
+    upper = key[:-1] + chr(ord(key[-1]) + 1)
+    return and_(ItemSearch.name_latin >= key, ItemSearch.name_latin < upper)
+
+
+def substring_hits(query, key: str, not_prefix, after: tuple | None, count: int) -> list:
+    """
+    The next `count` non-prefix matches after `after` (name_latin,
+    item_code), by (name_len, item_code). Every term of `key` must occur
+    in the name; terms shorter than a trigram are checked on the name
+    alone, the longer ones also narrow through the FTS index.
+
+    Reading every FTS hit of a broad term costs more than the whole page,
+    so names are first checked while walking the next SCAN_WINDOW rows
+    of the rank index, which fills a page of any common term. Sparse
+    terms then continue from the FTS hits past that window.
+    """
+    rank = (ItemSearch.name_len, ItemSearch.item_code)
+    query = query.filter(not_prefix)
+    if after:
+        start = (len(after[0]), after[1])
+        query = query.filter(tuple_(*rank) > tuple_(*start))
+    else:
+        start = None
+
+    query = query.filter(*(
+        ItemSearch.name_latin.contains(t, autoescape=True) for t in key.split()
+    ))
+    if not indexed_terms(key):
+        # only short terms: just the walk, they match often
+        return query.order_by(*rank).limit(count).all()
+
+    keys = query.session.query(*rank)
+    if start:
+        keys = keys.filter(tuple_(*rank) > tuple_(*start))
+    window_end = keys.order_by(*rank).offset(SCAN_WINDOW - 1).limit(1).first()
+
+    window = query
+    if window_end:
+        window = window.filter(tuple_(*rank) <= tuple_(*window_end))
+    hits = window.order_by(*rank).limit(count).all()
+    if len(hits) == count or window_end is None:
+        return hits
+
+    fts_hits = select(items_fts.c.rowid).where(
+        literal_column("items_fts").op("MATCH")(match_expression(key))
+    )
+    return hits + (
+        query.filter(ItemSearch.id.in_(fts_hits), tuple_(*rank) > tuple_(*window_end))
+        .order_by(*rank).limit(count - len(hits)).all()
+    )
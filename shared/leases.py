@@ -0,0 +1,69 @@
+# shared/leases.py
+import datetime
+import os
+import socket
+
+from sqlalchemy import and_, or_, select, update
+
+# Identifies this worker process in claimed_by
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# How long a claim holds; a crashed worker's rows are re-claimable after it
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", 300))
+
+
+def claim(db, model, ready, limit: int, lease: int = LEASE_SECONDS, **values) -> list[int]:
+    """
+    Leases up to `limit` rows of `model` matching `ready` whose lease is
+    free or expired, and returns their ids (oldest first).
+
+    One UPDATE ... RETURNING re-checks the lease under the database write
+    lock, so concurrent workers, on any node, never get the same row.
+    `values` are extra columns set on the claimed rows.
+    """
+    now = datetime.datetime.utcnow()
+    claimable = and_(
+        ready,
+        or_(model.lease_until.is_(None), model.lease_until < now)
+    )
+    due = select(model.id).where(claimable).order_by(model.id).limit(limit)
+
+    stmt = (
+        update(model)
+        .where(model.id.in_(due), claimable)
+        .values(
+            claimed_by=WORKER_ID,
+            lease_until=now + datetime.timedelta(seconds=lease),
+            **values
+        )
+        .returning(model.id)
+        .execution_options(synchronize_session=False)
+    )
+    ids = sorted(db.execute(stmt).scalars())
+    db.commit()
+    return ids
+
+
+def release(row):
+    """Gives up the claim on a loaded row (committed by the caller)."""
+    row.claimed_by = None
+    row.lease_until = None
+
+
+def renew(db, model, ids: list[int], lease: int = LEASE_SECONDS) -> list[int]:
+    """
+    Extends this worker's lease on `ids` for `lease` seconds and returns
+    the ids it still held (oldest first). Rows another worker took over
+    after the lease ran out are left out; the caller must not touch them.
+    """
+    now = datetime.datetime.utcnow()
+    stmt = (
+        update(model)
+        .where(model.id.in_(ids), model.claimed_by == WORKER_ID)
+        .values(lease_until=now + datetime.timedelta(seconds=lease))
+        .returning(model.id)
+        .execution_options(synchronize_session=False)
+    )
+    held = sorted(db.execute(stmt).scalars())
+    db.commit()
+    return held
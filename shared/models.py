@@ -1,7 +1,8 @@
 # shared/models.py
 import datetime
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, Numeric, Float, ForeignKey
+    Column, Integer, String, Boolean, DateTime, Numeric, Float, ForeignKey, Index,
+    DDL, event
 )
 from sqlalchemy.orm import relationship
 
@@ -29,6 +30,10 @@ class Delivery(Base):
 
     sap_synced = Column(Boolean, default=False)
 
+    # approval push-back lease (shared/leases.py)
+    claimed_by = Column(String, nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     # ✅ NEW
@@ -38,6 +43,13 @@ class Delivery(Base):
         cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        # /api/history keyset pagination
+        Index("ix_deliveries_history", "card_code", "date", "created_at", "id"),
+        # approvals not yet pushed to SAP, looked up on every commit
+        Index("ix_deliveries_approval_sync", "approved", "sap_synced"),
+    )
+
 
 class DeliveryItem(Base):
     __tablename__ = "delivery_items"
@@ -55,6 +67,51 @@ class DeliveryItem(Base):
     delivery = relationship("Delivery", back_populates="items")
 
 
+class NotificationOutbox(Base):
+    """
+    Pending Telegram notifications.
+
+    Rows are written in the same transaction as the delivery insert and
+    leased in batches by worker/notify_dispatch.py (shared/leases.py).
+    """
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True)
+    delivery_id = Column(Integer, ForeignKey("deliveries.id"), nullable=False)
+    telegram_id = Column(Integer, nullable=False)
+
+    status = Column(String, default="pending")  # pending | sent | failed | skipped
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+    pages_sent = Column(Integer, default=0)  # album pages already in the chat
+
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    claimed_by = Column(String, nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_notification_outbox_due", "status", "next_attempt_at"),
+    )
+
+
+class DeliveryImage(Base):
+    """
+    Content-addressed render cache: the rendered invoice pages per payload
+    hash, plus the Telegram file_id of each page's first upload.
+    """
+    __tablename__ = "delivery_images"
+
+    payload_hash = Column(String, primary_key=True)
+    page = Column(Integer, primary_key=True, default=1)
+    delivery_id = Column(Integer, ForeignKey("deliveries.id"), index=True)
+    file_path = Column(String, nullable=False)
+    telegram_file_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
 class TelegramUser(Base):
     __tablename__ = "telegram_users"
 
@@ -75,6 +132,48 @@ class TelegramUser(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
 
+class BusinessPartner(Base):
+    """Local snapshot of SAP OCRD customers, maintained by worker/bp_sync.py"""
+    __tablename__ = "business_partners"
+
+    card_code = Column(String, primary_key=True)
+    card_name = Column(String, nullable=True)
+    valid_for = Column(String, default="Y")
+
+    # SAP change tracking (OCRD.UpdateDate / UpdateTS as HHMMSS)
+    update_date = Column(String, nullable=True)
+    update_ts = Column(Integer, nullable=True)
+
+    synced_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    phones = relationship(
+        "BusinessPartnerPhone",
+        back_populates="partner",
+        cascade="all, delete-orphan"
+    )
+
+
+class BusinessPartnerPhone(Base):
+    """Normalized phone (see shared/phones.py) -> CardCode index"""
+    __tablename__ = "business_partner_phones"
+
+    phone = Column(String, primary_key=True)
+    card_code = Column(
+        String, ForeignKey("business_partners.card_code"), primary_key=True, index=True
+    )
+
+    partner = relationship("BusinessPartner", back_populates="phones")
+
+
+class SyncState(Base):
+    """Key/value store for sync watermarks"""
+    __tablename__ = "sync_state"
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
 # -------------------------------------------------
 # Marketplace Models
 # -------------------------------------------------
@@ -87,12 +186,58 @@ class Item(Base):
     quantity = Column(Float, default=0.0)
     price = Column(Float, default=0.0)
     currency = Column(String, default="UZS")
-    
+
+    # "/"-rooted URL of the primary image, kept by the item_images triggers below
+    image_url = Column(String, nullable=True)
 
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     images = relationship("ItemImage", back_populates="item", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # /api/items keyset pagination
+        Index("ix_items_updated_code", "updated_at", "item_code"),
+    )
+
+
+class ItemSearch(Base):
+    """
+    Search keys of items, the content table of the `items_fts` FTS5
+    index (created with it below, kept in sync by triggers).
+    Written by worker/item_sync.py, see shared/item_search.py.
+    """
+    __tablename__ = "item_search"
+
+    id = Column(Integer, primary_key=True)  # FTS rowid
+    item_code = Column(String, ForeignKey("items.item_code"), unique=True, nullable=False)
+    name_latin = Column(String, nullable=False)  # transliterated, folded item_name
+    name_len = Column(Integer, nullable=False)  # len(name_latin), the search rank
+
+    __table_args__ = (
+        # search ranking: prefix hits by range scan, the other hits shortest first
+        Index("ix_item_search_prefix", "name_latin", "item_code"),
+        Index("ix_item_search_len_code", "name_len", "item_code"),
+    )
+
+
+# trigram: substring matches of 3+ characters, served from the index
+for ddl in (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+           name_latin, content='item_search', content_rowid='id', tokenize='trigram'
+       )""",
+    """CREATE TRIGGER IF NOT EXISTS item_search_ai AFTER INSERT ON item_search BEGIN
+           INSERT INTO items_fts(rowid, name_latin) VALUES (new.id, new.name_latin);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS item_search_ad AFTER DELETE ON item_search BEGIN
+           INSERT INTO items_fts(items_fts, rowid, name_latin) VALUES ('delete', old.id, old.name_latin);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS item_search_au AFTER UPDATE ON item_search BEGIN
+           INSERT INTO items_fts(items_fts, rowid, name_latin) VALUES ('delete', old.id, old.name_latin);
+           INSERT INTO items_fts(rowid, name_latin) VALUES (new.id, new.name_latin);
+       END""",
+):
+    event.listen(ItemSearch.__table__, "after_create", DDL(ddl))
+
 
 class ItemImage(Base):
     __tablename__ = "item_images"
@@ -105,6 +250,39 @@ class ItemImage(Base):
 
     item = relationship("Item", back_populates="images")
 
+    __table_args__ = (
+        # primary image lookup of PRIMARY_IMAGE_URL
+        Index("ix_item_images_primary", "item_code", "is_primary"),
+    )
+
+
+# items.image_url of an item: its primary (else first) image, with
+# forward slashes and a leading "/", resolved here once per image change
+PRIMARY_IMAGE_URL = r"""(
+    SELECT CASE WHEN substr(path, 1, 1) = '/' THEN path ELSE '/' || path END
+    FROM (
+        SELECT replace(file_path, '\', '/') AS path FROM item_images
+        WHERE item_images.item_code = items.item_code
+        ORDER BY is_primary DESC, id
+        LIMIT 1
+    )
+)"""
+
+ITEM_IMAGE_TRIGGERS = (
+    f"""CREATE TRIGGER IF NOT EXISTS item_images_url_ai AFTER INSERT ON item_images BEGIN
+           UPDATE items SET image_url = {PRIMARY_IMAGE_URL} WHERE item_code = new.item_code;
+       END""",
+    f"""CREATE TRIGGER IF NOT EXISTS item_images_url_ad AFTER DELETE ON item_images BEGIN
+           UPDATE items SET image_url = {PRIMARY_IMAGE_URL} WHERE item_code = old.item_code;
+       END""",
+    f"""CREATE TRIGGER IF NOT EXISTS item_images_url_au AFTER UPDATE ON item_images BEGIN
+           UPDATE items SET image_url = {PRIMARY_IMAGE_URL}
+           WHERE item_code IN (old.item_code, new.item_code);
+       END""",
+)
+for ddl in ITEM_IMAGE_TRIGGERS:
+    event.listen(ItemImage.__table__, "after_create", DDL(ddl))
+
 
 class Order(Base):
     __tablename__ = "orders"
@@ -146,6 +324,36 @@ class OrderItem(Base):
     order = relationship("Order", back_populates="items")
 
 
+class OrderJob(Base):
+    """
+    Queue of orders to submit to SAP.
+
+    Enqueued in the same transaction as the order by the API and leased
+    by worker/order_sync.py (shared/leases.py).
+    """
+    __tablename__ = "order_jobs"
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), unique=True, nullable=False)
+
+    status = Column(String, default="pending")  # pending | running | done | failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    claimed_by = Column(String, nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+
+    order = relationship("Order")
+
+    __table_args__ = (
+        Index("ix_order_jobs_due", "status", "next_attempt_at"),
+    )
+
+
 class Cart(Base):
     """Server-side cart storage"""
     __tablename__ = "carts"
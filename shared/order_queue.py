@@ -0,0 +1,83 @@
+# shared/order_queue.py
+import datetime
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.dialects.sqlite import insert
+
+from shared.leases import claim
+from shared.models import Order, OrderJob
+from shared.service_layer import SL_CALL_MAX_SECONDS
+
+# An order job's lease covers one Service Layer call (the SAP lookup, then
+# renewed for the $batch) with room to spare, so no other worker can take
+# over a job whose order may still be on its way to SAP
+ORDER_LEASE_SECONDS = int(SL_CALL_MAX_SECONDS) + 60
+
+
+def enqueue_order(db, order: Order):
+    """Stages a submit job for `order`; the worker sees it on the caller's commit."""
+    db.add(OrderJob(order=order))
+
+
+def enqueue_missing(db) -> int:
+    """
+    Jobs for 'new' orders that have none (placed before the queue existed).
+    Safe to run from several workers at once.
+    """
+    order_ids = db.scalars(
+        select(Order.id).where(
+            Order.status == "new",
+            Order.id.notin_(select(OrderJob.order_id))
+        )
+    ).all()
+    if order_ids:
+        db.execute(
+            insert(OrderJob).on_conflict_do_nothing(index_elements=[OrderJob.order_id]),
+            [{"order_id": order_id} for order_id in order_ids]
+        )
+    return len(order_ids)
+
+
+def claim_jobs(db, limit: int) -> list[int]:
+    """
+    Leases up to `limit` due jobs to this worker and marks them running.
+    Running jobs whose lease ran out (their worker died) are taken over.
+    """
+    now = datetime.datetime.utcnow()
+    ready = or_(
+        and_(OrderJob.status == "pending", OrderJob.next_attempt_at <= now),
+        OrderJob.status == "running"
+    )
+    return claim(
+        db, OrderJob, ready, limit,
+        lease=ORDER_LEASE_SECONDS,
+        status="running",
+        attempts=OrderJob.attempts + 1
+    )
+
+
+class CommitWatcher:
+    """
+    Notices commits made by other connections, the API process included,
+    with SQLite's `PRAGMA data_version` - a header read, cheap enough to
+    poll every few milliseconds.
+    """
+
+    def __init__(self, engine):
+        self.conn = engine.raw_connection()
+        self.version = None
+
+    def changed(self) -> bool:
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("PRAGMA data_version")
+            version = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+        changed = version != self.version
+        self.version = version
+        return changed
+
+    def close(self):
+        self.conn.close()
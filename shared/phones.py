@@ -0,0 +1,59 @@
+# shared/phones.py
+import os
+import re
+
+# Numbers without a country code are assumed to be local (Uzbekistan)
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "998")
+NATIONAL_NUMBER_LENGTH = int(os.getenv("NATIONAL_NUMBER_LENGTH", 9))
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_phone(phone: str | None) -> str:
+    """
+    Normalizes a phone number to E.164 digits without the leading "+",
+    e.g. "+998 90 123-45-67", "00998901234567", "8 90 1234567" and
+    "90 123 45 67" all become "998901234567".
+    """
+    if not phone:
+        return ""
+
+    digits = _NON_DIGITS.sub("", str(phone))
+
+    if digits.startswith("00"):
+        # international call prefix
+        return digits[2:]
+
+    if len(digits) == NATIONAL_NUMBER_LENGTH:
+        return DEFAULT_COUNTRY_CODE + digits
+
+    if len(digits) == NATIONAL_NUMBER_LENGTH + 1 and digits.startswith("8"):
+        # old national trunk prefix
+        return DEFAULT_COUNTRY_CODE + digits[1:]
+
+    return digits
+
+
+def build_phone_index(partners: dict) -> dict[str, str]:
+    """
+    Builds a normalized phone -> CardCode index over `partners`
+    ({card_code: {"phones": [...], "validFor": "Y"|"N", ...}}).
+
+    When several partners share a phone, an active one (validFor = "Y")
+    wins over an inactive one, otherwise the first one seen is kept.
+    """
+    index: dict[str, str] = {}
+
+    for card_code, bp in partners.items():
+        for phone in bp.get("phones", []):
+            phone = normalize_phone(phone)
+            if not phone:
+                continue
+
+            current = index.get(phone)
+            if current is None or (
+                partners[current]["validFor"] != "Y" and bp["validFor"] == "Y"
+            ):
+                index[phone] = card_code
+
+    return index
@@ -0,0 +1,73 @@
+# shared/render_pool.py
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from shared.image_renderer import get_renderer, render_delivery_pages_cached
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+
+# Render processes start while the worker already runs threads (to_thread,
+# the HANA pool); forking then could copy locks those threads hold
+RENDER_START_METHOD = os.getenv(
+    "RENDER_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def _warm_up():
+    # load fonts once per worker process, before the first job arrives
+    get_renderer()
+
+
+def _noop():
+    pass
+
+
+def get_render_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context(RENDER_START_METHOD),
+            initializer=_warm_up
+        )
+    return _executor
+
+
+async def start_render_pool():
+    """
+    Starts the render processes and waits until they have loaded their
+    fonts. The executor only spawns a process per submit while none is
+    idle, so one no-op job per worker is sent up front.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_render_executor()
+    await asyncio.gather(*(
+        loop.run_in_executor(executor, _noop)
+        for _ in range(RENDER_WORKERS)
+    ))
+
+
+async def render_in_pool(delivery: dict, key: str | None = None) -> list[str]:
+    """
+    Renders the pages of a delivery payload in the process pool, keeping
+    the CPU-bound Pillow work off the event loop thread.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_render_executor(),
+        render_delivery_pages_cached,
+        delivery,
+        key
+    )
+
+
+def shutdown_render_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
@@ -33,9 +33,9 @@ class DeliveryOut(BaseModel):
 
 
 class HistoryOut(BaseModel):
-    total: int
+    total: int | None = None  # only with include_total=true
     limit: int
-    offset: int
+    next_cursor: str | None = None
     items: list[DeliveryOut]
 
 
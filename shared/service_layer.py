@@ -0,0 +1,336 @@
+# shared/service_layer.py
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+
+SL_HOST = os.getenv("SL_HOST", "https://hana_host:50000/b1s/v1")
+SL_COMPANYDB = os.getenv("SL_COMPANYDB", "CompanyDB")
+SL_USER = os.getenv("SL_USER", "username")
+SL_PASSWORD = os.getenv("SL_PASSWORD", "password")
+
+# Each logged-in session holds a B1SESSION (and a license) on the server
+SL_MAX_SESSIONS = int(os.getenv("SL_MAX_SESSIONS", 4))
+SL_POOL_TIMEOUT = float(os.getenv("SL_POOL_TIMEOUT", 60))  # seconds
+SL_REQUEST_TIMEOUT = float(os.getenv("SL_REQUEST_TIMEOUT", 120))
+
+# Longest one request() can take: the wait for a pooled session, a
+# login, the request, then a re-login and retry after a 401
+SL_CALL_MAX_SECONDS = SL_POOL_TIMEOUT + 4 * SL_REQUEST_TIMEOUT
+
+# Re-login this long before the server-side SessionTimeout runs out
+SESSION_EXPIRY_MARGIN = 60
+
+# Requests per $batch call
+SL_BATCH_SIZE = int(os.getenv("SL_BATCH_SIZE", 50))
+
+# "/b1s/v1" - batch parts address resources relative to the server root
+SL_ROOT_PATH = urlparse(SL_HOST).path.rstrip("/")
+
+
+class ServiceLayerError(Exception):
+    def __init__(self, status: int, description: str):
+        super().__init__(f"{status}: {description}")
+        self.status = status
+        self.description = description
+
+
+class BatchError(Exception):
+    pass
+
+
+class SLSession:
+    """One logged-in B1SESSION on a keep-alive requests session."""
+
+    def __init__(self):
+        self.http = requests.Session()
+        self.http.verify = False
+        self.timeout = 0.0
+        self.expires_at = 0.0
+
+    def login(self):
+        resp = self.http.post(
+            f"{SL_HOST}/Login",
+            json={
+                "CompanyDB": SL_COMPANYDB,
+                "UserName": SL_USER,
+                "Password": SL_PASSWORD
+            },
+            timeout=SL_REQUEST_TIMEOUT
+        )
+        if resp.status_code != 200:
+            raise ServiceLayerError(resp.status_code, f"SL Login Failed: {resp.text}")
+
+        # SessionTimeout is in minutes and slides with every request
+        self.timeout = float(resp.json().get("SessionTimeout", 30)) * 60
+        self.touch()
+
+    def touch(self):
+        self.expires_at = time.monotonic() + self.timeout - SESSION_EXPIRY_MARGIN
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def logout(self):
+        try:
+            if not self.expired():
+                self.http.post(f"{SL_HOST}/Logout", timeout=SL_REQUEST_TIMEOUT)
+        except requests.RequestException:
+            pass
+        finally:
+            self.http.close()
+
+
+class ServiceLayerClient:
+    """
+    Bounded, thread-safe pool of long-lived Service Layer sessions.
+
+    Sessions are reused until their SessionTimeout runs out, re-logged in
+    transparently on 401 and logged out on close().
+    """
+
+    def __init__(self, max_sessions: int = SL_MAX_SESSIONS, timeout: float = SL_POOL_TIMEOUT):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_sessions)
+        self._idle: deque[SLSession] = deque()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Service Layer session pool exhausted")
+
+        try:
+            with self._lock:
+                sl = self._idle.pop() if self._idle else SLSession()
+
+            if sl.expired():
+                try:
+                    sl.login()
+                except Exception:
+                    sl.http.close()
+                    raise
+
+            try:
+                yield sl
+            finally:
+                # a failed request doesn't end the B1SESSION, keep it for reuse
+                sl.touch()
+                with self._lock:
+                    self._idle.append(sl)
+        finally:
+            self._slots.release()
+
+    def request(self, method: str, resource: str, **kwargs) -> requests.Response:
+        """
+        `method` on `<SL_HOST>/<resource>`; requests keyword arguments
+        pass through. The response is returned whatever its status.
+        """
+        kwargs.setdefault("timeout", SL_REQUEST_TIMEOUT)
+
+        with self.session() as sl:
+            resp = sl.http.request(method, f"{SL_HOST}/{resource}", **kwargs)
+            if resp.status_code == 401:
+                # session expired or was killed on the server
+                sl.login()
+                resp = sl.http.request(method, f"{SL_HOST}/{resource}", **kwargs)
+            return resp
+
+    def get(self, resource: str, **kwargs) -> requests.Response:
+        return self.request("GET", resource, **kwargs)
+
+    def get_all(self, resource: str, page_size: int, params: dict | None = None) -> list[dict]:
+        """
+        Every row of a collection GET. The Service Layer pages results
+        (B1S_PageSize, 20 by default), so pages of `page_size` are asked
+        for and odata.nextLink is followed to the end.
+        """
+        headers = {"Prefer": f"odata.maxpagesize={page_size}"}
+        rows = []
+        while resource:
+            resp = self.get(resource, params=params, headers=headers)
+            if resp.status_code != 200:
+                raise ServiceLayerError(resp.status_code, f"GET {resource}: {resp.text[:250]}")
+
+            data = resp.json()
+            rows += data.get("value", [])
+
+            # the link carries the whole query, relative to SL_HOST or the server root
+            link = data.get("odata.nextLink") or data.get("@odata.nextLink") or ""
+            if link.startswith(SL_ROOT_PATH + "/"):
+                link = link[len(SL_ROOT_PATH) + 1:]
+            resource, params = link.lstrip("/"), None
+        return rows
+
+    def post(self, resource: str, **kwargs) -> requests.Response:
+        return self.request("POST", resource, **kwargs)
+
+    def patch(self, resource: str, **kwargs) -> requests.Response:
+        return self.request("PATCH", resource, **kwargs)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for sl in idle:
+            sl.logout()
+
+
+_client: ServiceLayerClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_sl_client() -> ServiceLayerClient:
+    """Process-wide client shared by all Service Layer callers."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ServiceLayerClient()
+        return _client
+
+
+def close_sl_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def build_batch(operations: list[tuple[str, str, dict | None]], boundary: str) -> bytes:
+    """
+    Encodes (method, resource, payload) operations as an OData $batch body.
+
+    Every operation gets its own changeset, so one failing part doesn't
+    roll back the others.
+    """
+    lines = []
+    for n, (method, resource, payload) in enumerate(operations, start=1):
+        changeset = f"changeset_{uuid.uuid4().hex}"
+        lines += [
+            f"--{boundary}",
+            f"Content-Type: multipart/mixed;boundary={changeset}",
+            "",
+            f"--{changeset}",
+            "Content-Type: application/http",
+            "Content-Transfer-Encoding: binary",
+            f"Content-ID: {n}",
+            "",
+            f"{method} {SL_ROOT_PATH}/{resource} HTTP/1.1",
+            "Content-Type: application/json",
+            "",
+            json.dumps(payload) if payload is not None else "",
+            f"--{changeset}--",
+        ]
+    lines += [f"--{boundary}--", ""]
+    return "\r\n".join(lines).encode("utf-8")
+
+
+def _split_headers(text: str) -> tuple[dict, str]:
+    head, _, body = text.partition("\n\n")
+    headers = {}
+    for line in head.split("\n"):
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers, body
+
+
+def _boundary(content_type: str) -> str | None:
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary":
+            return value.strip('"')
+    return None
+
+
+def _http_response(text: str) -> tuple[int, dict | str | None]:
+    """Parses an embedded `HTTP/1.1 201 Created` response."""
+    status_line, _, rest = text.lstrip("\n").partition("\n")
+    status = int(status_line.split()[1])
+
+    # no headers: the blank line follows the status line directly
+    body = rest[1:] if rest.startswith("\n") else _split_headers(rest)[1]
+    body = body.strip()
+    if not body:
+        return status, None
+    try:
+        return status, json.loads(body)
+    except ValueError:
+        return status, body
+
+
+def parse_batch_response(content_type: str, body: str) -> list[tuple[int | None, int, dict | str | None]]:
+    """(Content-ID, status, body) of every part of a $batch response, in response order."""
+    boundary = _boundary(content_type)
+    if not boundary:
+        raise BatchError(f"Not a multipart response: {content_type}")
+
+    results = []
+    body = body.replace("\r\n", "\n")
+    for part in body.split(f"--{boundary}")[1:]:
+        if part.startswith("--"):
+            break
+
+        headers, content = _split_headers(part.lstrip("\n"))
+        part_type = headers.get("content-type", "")
+        if part_type.startswith("multipart/mixed"):
+            # changeset: a failed one holds just the error response
+            results += parse_batch_response(part_type, content)
+        else:
+            content_id = headers.get("content-id")
+            results.append((
+                int(content_id) if content_id and content_id.isdigit() else None,
+                *_http_response(content)
+            ))
+    return results
+
+
+def send_batch(operations: list[tuple[str, str, dict | None]]) -> list[tuple[int, dict | str | None]]:
+    """
+    Sends the operations in one POST /$batch call and returns the
+    per-operation (status, body).
+
+    The Service Layer is asked to go on past failed changesets; an
+    operation it still returned nothing for gets status 424 (not executed).
+    """
+    boundary = f"batch_{uuid.uuid4().hex}"
+    resp = get_sl_client().post(
+        "$batch",
+        data=build_batch(operations, boundary),
+        headers={
+            "Content-Type": f"multipart/mixed;boundary={boundary}",
+            "Prefer": "odata.continue-on-error"
+        }
+    )
+    if resp.status_code not in (200, 202):
+        raise BatchError(f"$batch failed: {resp.status_code} - {resp.text[:250]}")
+
+    results = [None] * len(operations)
+    parts = parse_batch_response(resp.headers.get("Content-Type", ""), resp.text)
+    for position, (content_id, status, body) in enumerate(parts):
+        # error parts may come back without their Content-ID
+        index = content_id - 1 if content_id else position
+        if 0 <= index < len(results) and results[index] is None:
+            results[index] = (status, body)
+
+    return [
+        result or (424, "No response for this request in the $batch reply")
+        for result in results
+    ]
+
+
+def error_message(body) -> str:
+    """Service Layer error text from a part body."""
+    if isinstance(body, dict):
+        message = (body.get("error") or {}).get("message")
+        if isinstance(message, dict):
+            message = message.get("value")
+        if message:
+            return str(message)
+    return str(body)
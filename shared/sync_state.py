@@ -0,0 +1,40 @@
+# shared/sync_state.py
+from typing import Iterable
+
+from shared.models import SyncState
+
+
+def get_state(db, key: str, default: str | None = None) -> str | None:
+    state = db.get(SyncState, key)
+    return state.value if state and state.value is not None else default
+
+
+def set_state(db, key: str, value: str | None):
+    """Stages the new value; committed with the caller's transaction."""
+    state = db.get(SyncState, key)
+    if state is None:
+        db.add(SyncState(key=key, value=value))
+    else:
+        state.value = value
+
+
+def parse_watermark(watermark: str | None) -> tuple[str, int] | None:
+    """Splits a "<UpdateDate>|<UpdateTS>" watermark."""
+    if not watermark:
+        return None
+    update_date, update_ts = watermark.split("|")
+    return update_date, int(update_ts)
+
+
+def max_watermark(records: Iterable[dict]) -> str | None:
+    """Highest (update_date, update_ts) of SAP records, as a watermark string."""
+    marks = [
+        (r["update_date"], r["update_ts"] or 0)
+        for r in records
+        if r["update_date"]
+    ]
+    if not marks:
+        return None
+    update_date, update_ts = max(marks)
+    # fixed width, so watermarks compare correctly as strings
+    return f"{update_date}|{update_ts:06d}"
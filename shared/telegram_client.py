@@ -0,0 +1,230 @@
+# shared/telegram_client.py
+import asyncio
+import json
+import os
+import time
+from typing import Callable
+
+import aiohttp
+
+from shared.config import BOT_TOKEN
+
+TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
+
+# Documented Bot API limits: ~30 messages/s overall, 1 message/s per chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", 30))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 3))
+
+# Idle per-chat buckets are dropped once there are more than this many
+CHAT_BUCKET_LIMIT = 10_000
+
+
+class TelegramError(Exception):
+    def __init__(self, status: int, description: str):
+        super().__init__(f"{status}: {description}")
+        self.status = status
+        self.description = description
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+    async def acquire(self, cost: float = 1):
+        """
+        Takes `cost` tokens. A cost above the capacity goes through once
+        the bucket is full and leaves it in debt, so later callers wait
+        until the whole cost is paid back.
+        """
+        needed = min(cost, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= needed:
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+
+class TelegramClient:
+    """
+    Bot API client on one pooled aiohttp session.
+
+    Every call passes a global and a per-chat token bucket. On 429 the
+    client pauses all sending for `retry_after` seconds and retries.
+    """
+
+    def __init__(
+        self,
+        api_url: str = TELEGRAM_API,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_rate: float = TELEGRAM_CHAT_RATE
+    ):
+        self.api_url = api_url
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.paused_until = 0.0
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=TELEGRAM_MAX_CONNECTIONS),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= CHAT_BUCKET_LIMIT:
+                self.chat_buckets = {
+                    k: b for k, b in self.chat_buckets.items() if not b.idle()
+                }
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    async def _throttle(self, chat_id: int | None, cost: int):
+        # per-chat wait first: a global token taken before it would be held
+        # through that wait and then spent in a burst with others, so the
+        # global token is taken last, right before the request. Telegram
+        # counts every album item against the chat's limit, hence `cost`
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire(cost)
+
+        pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+        await self.global_bucket.acquire(cost)
+
+    async def call(
+        self,
+        method: str,
+        data: dict | Callable[[], aiohttp.FormData],
+        chat_id: int | None = None,
+        cost: int = 1
+    ):
+        """
+        Calls a Bot API method and returns its "result".
+
+        `data` is either plain form fields or a factory building a fresh
+        FormData (file uploads can't be re-sent from a consumed form).
+        """
+        for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+            await self._throttle(chat_id, cost)
+
+            body = data() if callable(data) else data
+            async with self.session.post(f"{self.api_url}/{method}", data=body) as resp:
+                payload = await resp.json(content_type=None)
+
+            if payload.get("ok"):
+                return payload["result"]
+
+            retry_after = (payload.get("parameters") or {}).get("retry_after")
+            if resp.status == 429 and retry_after and attempt < TELEGRAM_MAX_RETRIES:
+                print(f"⚠ Telegram 429 on {method}, retry after {retry_after}s")
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                continue
+
+            raise TelegramError(resp.status, payload.get("description", ""))
+
+    async def send_message(self, chat_id: int, text: str, reply_markup: dict | None = None):
+        data = {"chat_id": str(chat_id), "text": text, "parse_mode": "HTML"}
+        if reply_markup:
+            data["reply_markup"] = json.dumps(reply_markup)
+        return await self.call("sendMessage", data, chat_id=chat_id)
+
+    async def send_photo(
+        self,
+        chat_id: int,
+        photo: str,
+        caption: str = "",
+        reply_markup: dict | None = None,
+        is_file_id: bool = False
+    ) -> str:
+        """Sends a photo by path or file_id and returns the sent file_id."""
+        fields = {"chat_id": str(chat_id), "caption": caption, "parse_mode": "HTML"}
+        if reply_markup:
+            fields["reply_markup"] = json.dumps(reply_markup)
+
+        def form() -> aiohttp.FormData:
+            data = aiohttp.FormData(fields)
+            if is_file_id:
+                data.add_field("photo", photo)
+            else:
+                with open(photo, "rb") as f:
+                    data.add_field("photo", f.read(), filename=os.path.basename(photo))
+            return data
+
+        result = await self.call("sendPhoto", form, chat_id=chat_id)
+        # largest size comes last
+        return result["photo"][-1]["file_id"]
+
+    async def send_media_group(
+        self,
+        chat_id: int,
+        photos: list[str],
+        is_file_id: bool = False
+    ) -> list[str]:
+        """Sends 2-10 photos as an album and returns their file_ids."""
+
+        def form() -> aiohttp.FormData:
+            media = []
+            data = aiohttp.FormData({"chat_id": str(chat_id)})
+            for n, photo in enumerate(photos):
+                if is_file_id:
+                    media.append({"type": "photo", "media": photo})
+                else:
+                    media.append({"type": "photo", "media": f"attach://page{n}"})
+                    with open(photo, "rb") as f:
+                        data.add_field(f"page{n}", f.read(), filename=os.path.basename(photo))
+            data.add_field("media", json.dumps(media))
+            return data
+
+        result = await self.call(
+            "sendMediaGroup", form, chat_id=chat_id, cost=len(photos)
+        )
+        return [message["photo"][-1]["file_id"] for message in result]
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+_client: TelegramClient | None = None
+
+
+def get_telegram_client() -> TelegramClient:
+    """Process-wide client, so all senders share one pool and one limiter."""
+    global _client
+    if _client is None:
+        _client = TelegramClient()
+    return _client
+
+
+async def close_telegram_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -1,32 +1,21 @@
 import os
-import requests
-import json
-from shared.config import BOT_TOKEN, WEBAPP_URL
+from shared.config import WEBAPP_URL
 from shared.models import TelegramUser
+from shared.telegram_client import TelegramError, get_telegram_client
 
-TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
 
+# Telegram accepts 2-10 photos per media group
+MEDIA_GROUP_LIMIT = 10
 
-def send_telegram_delivery_image(
-    user: TelegramUser,
-    image_path: str,
-    caption: str
-):
-    """
-    Sends delivery image to Telegram user with WebApp button
-    """
-
-    if not os.path.exists(image_path):
-        print("❌ Image not found:", image_path)
-        return
 
+def webapp_reply_markup(user: TelegramUser) -> dict:
     web_app_text = (
         "✅ Review & approve"
         if user.role == "approver"
         else "📦 View deliveries"
     )
 
-    reply_markup = {
+    return {
         "inline_keyboard": [
             [
                 {
@@ -39,28 +28,107 @@ def send_telegram_delivery_image(
         ]
     }
 
+
+async def send_telegram_delivery_image(
+    user: TelegramUser,
+    image_path: str | None,
+    caption: str,
+    file_id: str | None = None
+) -> str | None:
+    """
+    Sends delivery image to Telegram user with WebApp button.
+
+    When `file_id` of an earlier upload is given, the photo is re-sent
+    by reference instead of uploading `image_path` again.
+
+    Returns the Telegram file_id of the sent photo, or None on failure.
+    """
+
+    if not file_id and not os.path.exists(image_path):
+        print("❌ Image not found:", image_path)
+        return None
+
     try:
-        with open(image_path, "rb") as img:
-            response = requests.post(
-                f"{TELEGRAM_API}/sendPhoto",
-                data={
-                    "chat_id": user.telegram_id,
-                    "caption": caption,
-                    "parse_mode": "HTML",
-                    "reply_markup": json.dumps(reply_markup)
-                },
-                files={
-                    "photo": img
-                },
-                timeout=10
-            )
-
-        if not response.ok:
-            print(
-                "❌ Telegram sendPhoto failed:",
-                response.status_code,
-                response.text
-            )
+        return await get_telegram_client().send_photo(
+            user.telegram_id,
+            file_id or image_path,
+            caption=caption,
+            reply_markup=webapp_reply_markup(user),
+            is_file_id=bool(file_id)
+        )
+
+    except TelegramError as e:
+        print("❌ Telegram sendPhoto failed:", e)
+        return None
 
     except Exception as e:
         print("❌ Telegram notify error:", e)
+        return None
+
+
+class AlbumIncomplete(Exception):
+    """An album send failed after its first `pages_sent` pages reached the chat."""
+
+    def __init__(self, pages_sent: int, error: Exception):
+        super().__init__(f"{pages_sent} pages sent, then: {error}")
+        self.pages_sent = pages_sent
+
+
+async def send_telegram_delivery_album(
+    user: TelegramUser,
+    image_paths: list[str],
+    caption: str,
+    file_ids: list[str] | None = None,
+    pages_sent: int = 0
+) -> list[str] | None:
+    """
+    Sends a paginated delivery as Telegram media group(s), followed by
+    the caption with the WebApp button (media groups can't carry one).
+
+    When `file_ids` of an earlier upload are given, pages are re-sent
+    by reference instead of uploading `image_paths` again. The first
+    `pages_sent` pages, delivered by an earlier attempt, are skipped;
+    with all of them delivered only the caption is sent.
+
+    Returns the Telegram file_ids of the pages sent by this call, or None
+    on failure. A failure after more pages went out raises
+    AlbumIncomplete, so the retry can resume after them.
+    """
+
+    client = get_telegram_client()
+    sent_ids: list[str] = []
+    pages = file_ids or image_paths
+    resumed_at = pages_sent
+
+    try:
+        for start in range(pages_sent, len(pages), MEDIA_GROUP_LIMIT):
+            chunk = pages[start:start + MEDIA_GROUP_LIMIT]
+
+            if len(chunk) == 1:
+                # a media group needs at least two photos
+                sent_ids.append(await client.send_photo(
+                    user.telegram_id, chunk[0], is_file_id=bool(file_ids)
+                ))
+            else:
+                sent_ids.extend(await client.send_media_group(
+                    user.telegram_id, chunk, is_file_id=bool(file_ids)
+                ))
+            pages_sent = start + len(chunk)
+
+        await client.send_message(
+            user.telegram_id,
+            caption,
+            reply_markup=webapp_reply_markup(user)
+        )
+
+        return sent_ids
+
+    except Exception as e:
+        if isinstance(e, TelegramError):
+            print("❌ Telegram sendMediaGroup failed:", e)
+        else:
+            print("❌ Telegram notify error:", e)
+
+        if pages_sent > resumed_at:
+            raise AlbumIncomplete(pages_sent, e) from e
+        return None
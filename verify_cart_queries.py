@@ -0,0 +1,75 @@
+# verify_cart_queries.py
+"""
+Regression check for GET /api/cart: the number of queries must not
+grow with the cart (one joined query, whatever the line count).
+
+Runs on a throw-away SQLite database, never on data/deliveries.db.
+Exits non-zero on failure.
+
+Usage: python verify_cart_queries.py
+"""
+import os
+import sys
+import tempfile
+
+# Add the project root to the python path
+sys.path.append(os.getcwd())
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "verify_cart.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from sqlalchemy import event  # noqa: E402
+
+from api.main import get_cart  # noqa: E402
+from shared.db import Base, SessionLocal, engine  # noqa: E402
+from shared.models import Cart, Item, ItemImage, TelegramUser  # noqa: E402
+
+CART_SIZES = (1, 5, 30, 100)
+EXPECTED_QUERIES = 1
+
+
+def build(db, telegram_id: int, lines: int):
+    db.query(Cart).delete()
+    for n in range(lines):
+        code = f"CART{n:04d}"
+        if not db.get(Item, code):
+            db.add(Item(item_code=code, item_name=f"Item {n}", quantity=10, price=1000))
+            db.add(ItemImage(item_code=code, file_path=f"data\\item_images\\{code}.jpg", is_primary=True))
+        db.add(Cart(telegram_id=telegram_id, item_code=code, quantity=n + 1))
+    db.commit()
+
+
+def verify_cart_queries() -> bool:
+    Base.metadata.create_all(bind=engine)
+    user = TelegramUser(telegram_id=1001)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    ok = True
+    for lines in CART_SIZES:
+        db = SessionLocal()
+        try:
+            build(db, user.telegram_id, lines)
+            db.expunge_all()  # nothing served from the identity map
+
+            statements.clear()
+            cart = get_cart(user, db)
+            queries = len(statements)
+        finally:
+            db.close()
+
+        valid = (
+            len(cart) == lines
+            and cart[0]["image_url"] == "/data/item_images/CART0000.jpg"
+            and cart[-1]["line_total"] == 1000 * lines
+        )
+        print(f"cart of {lines:>3} lines: {queries} queries, {'ok' if valid else 'wrong result'}")
+        ok = ok and valid and queries == EXPECTED_QUERIES
+
+    print("Cart query count verification " + ("successful" if ok else "failed"))
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if verify_cart_queries() else 1)
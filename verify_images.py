@@ -31,7 +31,9 @@ def verify_images():
         # 3. Verify
         db.refresh(item)
         print(f"Item images count: {len(item.images)}")
-        if len(item.images) == 1 and item.images[0].file_path == img_path:
+        print(f"Item image_url: {item.image_url}")
+        if len(item.images) == 1 and item.images[0].file_path == img_path \
+                and item.image_url == "/" + img_path:
             print("Image verification successful")
         else:
             print("Image verification failed")
@@ -1,122 +1,161 @@
 import datetime
-import os
 import asyncio
+import os
 
-from hdbcli import dbapi
+from sqlalchemy import or_
 
+from shared.business_partners import (
+    PARTNERS_QUERY,
+    read_partners,
+    save_snapshot,
+    snapshot_index,
+)
 from shared.db import SessionLocal
+from shared.hana import hana_connection
 
 from shared.models import TelegramUser
+from shared.phones import build_phone_index, normalize_phone
+from shared.sync_state import get_state, max_watermark, parse_watermark, set_state
 
+# Delta runs only pull partners changed since the stored watermark;
+# a full reconcile re-reads all of OCRD as a safety net
+BP_FULL_RECONCILE_EVERY = int(os.getenv("BP_FULL_RECONCILE_EVERY", 3600 * 6))
 
-# --- HANA connection settings ---
-HANA_HOST = os.getenv("HANA_HOST", "hana_host")
-HANA_PORT = int(os.getenv("HANA_PORT", 30015))
-HANA_USER = os.getenv("HANA_USER", "username")
-HANA_PASSWORD = os.getenv("HANA_PASSWORD", "password")
-SL_COMPANYDB = os.getenv("SL_COMPANYDB", "CompanyDB")
-
-
-def get_hana_connection():
-    return dbapi.connect(
-        address=HANA_HOST,
-        port=HANA_PORT,
-        user=HANA_USER,
-        password=HANA_PASSWORD
-    )
-
+WATERMARK_KEY = "bp_sync.watermark"  # "<UpdateDate>|<UpdateTS>"
+LAST_FULL_KEY = "bp_sync.last_full"  # ISO datetime (UTC)
 
-def normalize_phone(phone: str) -> str:
-    if not phone:
-        return ""
-    return phone.replace(" ", "").replace("-", "").replace("+", "")
 
-
-def sync_business_partners():
+def sync_business_partners(full: bool | None = None):
     """
     Syncs SAP Business Partners with Telegram users.
     SAP is the source of truth.
+
+    :param full: force (True) or skip (False) the full reconcile;
+                 by default it runs every BP_FULL_RECONCILE_EVERY seconds
     """
     db = SessionLocal()
-    sap_bps = load_business_partners()  # SAP source
-
     try:
-        users = db.query(TelegramUser).filter(
-            TelegramUser.phone_verified == True
-        ).all()
+        now = datetime.datetime.utcnow()
+        watermark = get_state(db, WATERMARK_KEY)
+        last_full = get_state(db, LAST_FULL_KEY)
+
+        if full is None:
+            full = (
+                watermark is None
+                or last_full is None
+                or (now - datetime.datetime.fromisoformat(last_full)).total_seconds()
+                >= BP_FULL_RECONCILE_EVERY
+            )
+
+        since = None if full else parse_watermark(watermark)
+        sap_bps = load_business_partners(since)  # SAP source
+
+        save_snapshot(db, sap_bps, full=full)
+
+        if full:
+            users = db.query(TelegramUser).filter(
+                TelegramUser.phone_verified == True
+            ).all()
+        else:
+            users = affected_users(db, sap_bps)
+
+        if full:
+            phone_index = build_phone_index(sap_bps)  # built once per sync
+            partners = sap_bps
+        else:
+            phone_index, partners = snapshot_index(
+                db, {normalize_phone(u.phone_number) for u in users}
+            )
 
         for user in users:
-            phone = normalize_phone(user.phone_number)
-
-            matched_bp = None
-            for card_code, bp in sap_bps.items():
-                if normalize_phone(bp["phone"]) == phone:
-                    matched_bp = (card_code, bp)
-                    break
+            card_code = phone_index.get(normalize_phone(user.phone_number))
+            bp = partners.get(card_code)
 
-            print(matched_bp)
-            if matched_bp and bp["validFor"] == "Y":
+            if bp and bp["validFor"] == "Y":
                 user.card_code = card_code
                 user.card_name = bp["card_name"]
                 user.is_active = True
             else:
                 user.is_active = False
 
-            user.last_sap_sync = datetime.datetime.utcnow()
+            user.last_sap_sync = now
+
+        new_watermark = max_watermark(sap_bps.values())
+        if new_watermark and (watermark is None or new_watermark > watermark):
+            set_state(db, WATERMARK_KEY, new_watermark)
+        if full:
+            set_state(db, LAST_FULL_KEY, now.isoformat())
 
         db.commit()
+        print(
+            f"BP sync ({'full' if full else 'delta'}): "
+            f"{len(sap_bps)} partners, {len(users)} users updated."
+        )
 
     finally:
         db.close()
 
 
-def load_business_partners():
+def affected_users(db, changed: dict) -> list[TelegramUser]:
+    """Verified users linked to, or sharing a phone with, a changed partner."""
+    if not changed:
+        return []
+
+    phones = {
+        normalize_phone(p)
+        for data in changed.values()
+        for p in data["phones"]
+    } - {""}
+
+    # phone_number is stored normalized by the bot phone handler
+    return db.query(TelegramUser).filter(
+        TelegramUser.phone_verified == True,
+        or_(
+            TelegramUser.card_code.in_(list(changed)),
+            TelegramUser.phone_number.in_(phones)
+        )
+    ).all()
+
+
+def load_business_partners(since: tuple[str, int] | None = None):
     """
     Loads Business Partners from SAP B1 (HANA)
 
+    :param since: (UpdateDate, UpdateTS) watermark; only partners changed
+                  at or after it are returned. None loads all customers.
+
     Returns:
     {
         "C0001": {
             "card_name": "Customer A",
-            "phone": "+998901234567",
-            "validFor": "Y"
+            "phones": ["+998901234567", "71 123 45 67"],
+            "validFor": "Y",
+            "update_date": "2025-01-31",
+            "update_ts": 142501
         }
     }
     """
-    conn = get_hana_connection()
-    cursor = conn.cursor()
-
-    sql = f"""
-        SELECT
-            "CardCode",
-            "CardName",
-            COALESCE(NULLIF("Cellular", ''),
-                     NULLIF("Phone1", ''),
-                     "Phone2") AS "Phone",
-            "validFor"
-        FROM "{SL_COMPANYDB}"."OCRD"
-        WHERE "CardType" = 'C'
-    """
+    sql = PARTNERS_QUERY
+    params = ()
 
-    cursor.execute(sql)
-
-    result = {}
-    for card_code, card_name, phone, valid_for in cursor.fetchall():
-        result[card_code] = {
-            "card_name": card_name,
-            "phone": phone or "",
-            "validFor": valid_for
-        }
+    if since:
+        # >= on the boundary: re-reading a partner is harmless, missing one is not
+        sql += """
+          AND ("UpdateDate" > ?
+               OR ("UpdateDate" = ? AND IFNULL("UpdateTS", 0) >= ?))
+        """
+        params = (since[0], since[0], since[1])
 
-    cursor.close()
-    conn.close()
-    return result
+    with hana_connection() as conn:
+        cursor = conn.statement(sql)
+        cursor.execute(sql, params)
+        return read_partners(cursor)
 
 
 async def bp_sync_loop(period: int):
     while True:
         try:
-            sync_business_partners()
+            await asyncio.to_thread(sync_business_partners)
         except Exception as e:
             print("BP sync error:", e)
 
@@ -2,23 +2,27 @@
 
 import asyncio
 from datetime import datetime
+from itertools import islice
+import json
 import os
+import time
+from typing import Iterable, Iterator
 
-from hdbcli import dbapi
-from sqlalchemy import func
+from sqlalchemy import func, insert
 
 from shared.db import SessionLocal
-from shared.models import Delivery, TelegramUser, DeliveryItem
-from shared.payloads import build_delivery_payload
-from shared.telegram_notify import send_telegram_delivery_image
-from shared.image_renderer import render_delivery_image
-
-# --- HANA connection settings ---
-HANA_HOST = os.getenv("HANA_HOST", "hana_host")
-HANA_PORT = int(os.getenv("HANA_PORT", 30015))
-HANA_USER = os.getenv("HANA_USER", "username")
-HANA_PASSWORD = os.getenv("HANA_PASSWORD", "password")
-SL_COMPANYDB = os.getenv("SL_COMPANYDB", "CompanyDB")
+from shared.hana import SL_COMPANYDB, hana_connection
+from shared.models import Delivery, TelegramUser, DeliveryItem, NotificationOutbox
+from shared.sync_state import set_state
+
+HANA_FETCH_SIZE = int(os.getenv("HANA_FETCH_SIZE", 500))
+HANA_INSERT_BATCH = int(os.getenv("HANA_INSERT_BATCH", 200))
+
+# Change detection: MAX("DocEntry") of ODLN is polled every
+# HANA_PROBE_INTERVAL seconds; the full fetch only runs when it moved
+HANA_PROBE_INTERVAL = float(os.getenv("HANA_PROBE_INTERVAL", 5))
+PROBE_METRICS_EVERY = 60  # seconds between metric snapshots to sync_state
+PROBE_METRICS_KEY = "hana_sync.probe_metrics"
 
 temp_item = [
     {
@@ -32,24 +36,7 @@ temp_item = [
 ]
 
 
-def fetch_deliveries_from_sap(last_doc_entry: int) -> list[dict]:
-    """
-    Fetch delivery headers + items from SAP B1 HANA.
-
-    :param last_doc_entry: last synced DocEntry from local DB
-    :return: list of dicts (one row per delivery line)
-    """
-
-    conn = dbapi.connect(
-        address=HANA_HOST,
-        port=HANA_PORT,
-        user=HANA_USER,
-        password=HANA_PASSWORD
-    )
-
-    cursor = conn.cursor()
-
-    query = f"""
+DELIVERIES_QUERY = f"""
     SELECT
         H."DocEntry",
         H."DocNum",
@@ -80,147 +67,347 @@ def fetch_deliveries_from_sap(last_doc_entry: int) -> list[dict]:
         L."LineNum"
     """
 
+LAST_DOC_ENTRY_QUERY = f"""
+    SELECT IFNULL(MAX("DocEntry"), 0) FROM "{SL_COMPANYDB}"."ODLN"
+"""
+
+
+class ProbeMetrics:
+    """Latency and hit rate of the ODLN change-detection probe, failed syncs."""
+
+    def __init__(self):
+        self.probes = 0
+        self.hits = 0
+        self.errors = 0
+        self.sync_failures = 0
+        self.sync_failure_streak = 0
+        self.last_sync_failure_at = None
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_last = 0.0
+        self.last_hit_at = None
+
+    def record(self, latency: float, hit: bool):
+        self.probes += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.latency_last = latency
+        if hit:
+            self.hits += 1
+            self.last_hit_at = datetime.utcnow()
+
+    def record_sync(self, ok: bool):
+        if ok:
+            self.sync_failure_streak = 0
+            return
+        self.sync_failures += 1
+        self.sync_failure_streak += 1
+        self.last_sync_failure_at = datetime.utcnow()
+
+    def snapshot(self) -> dict:
+        return {
+            "probes": self.probes,
+            "hits": self.hits,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / self.probes, 4) if self.probes else 0.0,
+            "latency_avg_ms": round(self.latency_total / self.probes * 1000, 2) if self.probes else 0.0,
+            "latency_max_ms": round(self.latency_max * 1000, 2),
+            "latency_last_ms": round(self.latency_last * 1000, 2),
+            "last_hit_at": self.last_hit_at.isoformat() if self.last_hit_at else None,
+            "sync_failures": self.sync_failures,
+            "sync_failure_streak": self.sync_failure_streak,
+            "last_sync_failure_at": (
+                self.last_sync_failure_at.isoformat() if self.last_sync_failure_at else None
+            ),
+            "updated_at": datetime.utcnow().isoformat()
+        }
+
+
+probe_metrics = ProbeMetrics()
+
+
+def probe_last_doc_entry() -> tuple[int, float]:
+    """:return: (MAX("DocEntry") of ODLN, probe latency in seconds)"""
+    started = time.perf_counter()
+    with hana_connection() as conn:
+        cursor = conn.statement(LAST_DOC_ENTRY_QUERY)
+        cursor.execute(LAST_DOC_ENTRY_QUERY)
+        last_doc_entry = int(cursor.fetchone()[0])
+    return last_doc_entry, time.perf_counter() - started
+
+
+def save_probe_metrics():
+    db = SessionLocal()
     try:
-        cursor.execute(query, (last_doc_entry,))
+        set_state(db, PROBE_METRICS_KEY, json.dumps(probe_metrics.snapshot()))
+        db.commit()
+    finally:
+        db.close()
+
+
+def fetch_deliveries_from_sap(
+    last_doc_entry: int,
+    fetch_size: int = HANA_FETCH_SIZE
+) -> Iterator[dict]:
+    """
+    Stream delivery headers + items from SAP B1 HANA.
+
+    Rows are pulled with `fetchmany` in chunks of `fetch_size`, so only one
+    chunk is held in memory regardless of how far behind the local DB is.
+
+    :param last_doc_entry: last synced DocEntry from local DB
+    :param fetch_size: number of rows per `fetchmany` call
+    :return: iterator of dicts (one row per delivery line),
+             ordered by DocEntry, LineNum
+    """
+
+    with hana_connection() as conn:
+        cursor = conn.statement(DELIVERIES_QUERY)
+        cursor.execute(DELIVERIES_QUERY, (last_doc_entry,))
 
         columns = [col[0] for col in cursor.description]
-        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
-        return rows
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+
+            for row in rows:
+                yield dict(zip(columns, row))
 
-    finally:
-        cursor.close()
-        conn.close()
 
+async def hana_sync_loop(period: int, probe_interval: float = HANA_PROBE_INTERVAL):
+    """
+    Probes ODLN every `probe_interval` seconds and syncs deliveries only
+    when a DocEntry beyond the last synced one shows up. Without a working
+    probe it falls back to a sync every `period` seconds. A failed sync is
+    retried after a backoff that doubles up to `period`.
+    """
+    synced_upto = None  # probe result the last sync covered
+    last_sync = 0.0
+    retry_at = 0.0  # no sync before this, after a failed one
+    last_metrics = time.monotonic()
 
-async def hana_sync_loop(period: int):
     while True:
         try:
-            sync_deliveries()
+            try:
+                remote, latency = await asyncio.to_thread(probe_last_doc_entry)
+            except Exception as e:
+                print("HANA probe error:", e)
+                probe_metrics.errors += 1
+                remote = None
+            else:
+                hit = synced_upto is not None and remote > synced_upto
+                probe_metrics.record(latency, hit)
+
+            if remote is None:
+                run = time.monotonic() - last_sync >= period
+            else:
+                run = synced_upto is None or remote > synced_upto
+
+            if run and time.monotonic() >= retry_at:
+                try:
+                    # off the event loop, so the notification dispatcher keeps draining
+                    await asyncio.to_thread(sync_deliveries)
+                except Exception as e:
+                    # synced_upto stays behind, so without a backoff every
+                    # probe would rerun the full ODLN/DLN1 join
+                    probe_metrics.record_sync(ok=False)
+                    backoff = min(probe_interval * 2 ** probe_metrics.sync_failure_streak, period)
+                    retry_at = time.monotonic() + backoff
+                    print(f"HANA sync error, retrying in {backoff:.0f}s:", e)
+                else:
+                    probe_metrics.record_sync(ok=True)
+                    synced_upto = remote
+                    last_sync = time.monotonic()
+
+            if time.monotonic() - last_metrics >= PROBE_METRICS_EVERY:
+                last_metrics = time.monotonic()
+                await asyncio.to_thread(save_probe_metrics)
         except Exception as e:
             print("HANA sync error:", e)
 
-        await asyncio.sleep(period)
+        await asyncio.sleep(probe_interval)
 
 
 def sync_deliveries():
     db = SessionLocal()
+    synced = 0
+    lines = 0
+    started = time.perf_counter()
     try:
         last_doc_entry = get_last_doc_entry(db)
-        sap_docs = fetch_deliveries_from_sap(last_doc_entry)
-        grouped = group_deliveries(sap_docs)
-
-        for doc_entry, data in grouped.items():
-            exists = db.query(Delivery).filter(
-                Delivery.doc_entry == doc_entry
-            ).first()
-
-            if exists:
-                continue
-
-            delivery = Delivery(
-                doc_entry=doc_entry,
-                card_code=data["card_code"],
-                card_name=data["card_name"],
-                document_number=data["document_number"],
-                date=data["date"],
-                sales_manager=data["sales_manager"],
-                remarks=data["remarks"],
-                document_total_amount=data["total_amount"],
-                currency=data["currency"],
-                approved=False
-            )
-
-            db.add(delivery)
-            db.flush()  # 🔔 ensure ID is generated
-
-            items_payload: list[dict] = []
-
-            for item in data["items"]:
-                delivery_item = DeliveryItem(
-                    delivery_id=delivery.id,
-                    line_num=item["line_num"],
-                    item_code=item["item_code"],
-                    item_name=item["item_name"],
-                    quantity=item["quantity"],
-                    price=item["price"],
-                    line_total=item["line_total"]
-                )
-
-                db.add(delivery_item)
-
-                # build payload dict
-                items_payload.append({
-                    "line_num": item["line_num"],
-                    "item_code": item["item_code"],
-                    "item_name": item["item_name"],
-                    "quantity": item["quantity"],
-                    "price": item["price"],
-                    "line_total": item["line_total"],
-                    "uom": item.get("uom", "")  # optional
-                })
-
-            # 🔔 find telegram users for this CardCode
-            users = db.query(TelegramUser).filter(
-                TelegramUser.card_code == data["card_code"],
-                TelegramUser.is_active == True
-            ).all()
-
-            # 🔔 notify users
-            for user in users:
-                delivery_data = build_delivery_payload(delivery, items_payload)
-                #print(delivery_data)
-                image = render_delivery_image(delivery_data)
-
-                caption = (
-                    f"<b>📦 Новая отгрузка</b>\n"
-                    f"No: <b>{delivery.document_number}</b>\n"
-                    f"Дата: {delivery.date.strftime('%d.%m.%Y')}\n"
-                    f"Сумма: <b>{delivery.document_total_amount:,}</b>"
-                )
-
-                send_telegram_delivery_image(
-                    user=user,
-                    image_path=image,
-                    caption=caption
-                )
-
-        db.commit()
-        print(f"Synced {len(sap_docs)} deliveries from SAP.")
+        sap_rows = fetch_deliveries_from_sap(last_doc_entry)
+        deliveries = iter_grouped_deliveries(sap_rows)
+
+        # each batch of complete deliveries is committed on its own,
+        # so a crash mid-run resumes from the last committed DocEntry
+        for batch in iter_batches(deliveries, HANA_INSERT_BATCH):
+            inserted = insert_delivery_batch(db, batch)
+            enqueue_notifications(db, inserted)
+
+            db.commit()
+            synced += len(inserted)
+            lines += sum(len(d["items"]) for d in inserted)
+
+        elapsed = time.perf_counter() - started
+        rate = lines / elapsed if elapsed > 0 else 0.0
+        print(
+            f"Synced {synced} deliveries ({lines} lines) from SAP "
+            f"in {elapsed:.2f}s ({rate:,.0f} rows/s)."
+        )
     finally:
         db.close()
 
 
-def group_deliveries(rows: list[dict]) -> dict:
-    deliveries = {}
+def iter_batches(iterable: Iterable, size: int) -> Iterator[list]:
+    it = iter(iterable)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def insert_delivery_batch(db, batch: list[dict]) -> list[dict]:
+    """
+    Set-based insert of grouped deliveries.
+
+    Existing doc_entries are loaded with a single query, then headers and
+    lines are written with one executemany each.
+
+    :return: the inserted deliveries, each with its new local "id"
+    """
+    doc_entries = [d["doc_entry"] for d in batch]
+    existing = {
+        doc_entry for (doc_entry,) in
+        db.query(Delivery.doc_entry)
+          .filter(Delivery.doc_entry.in_(doc_entries))
+    }
+
+    new = [d for d in batch if d["doc_entry"] not in existing]
+    if not new:
+        return []
+
+    ids = dict(
+        db.execute(
+            insert(Delivery).returning(Delivery.doc_entry, Delivery.id),
+            [
+                {
+                    "doc_entry": d["doc_entry"],
+                    "card_code": d["card_code"],
+                    "card_name": d["card_name"],
+                    "document_number": d["document_number"],
+                    "date": d["date"],
+                    "sales_manager": d["sales_manager"],
+                    "remarks": d["remarks"],
+                    "document_total_amount": d["total_amount"],
+                    "currency": d["currency"],
+                    "approved": False
+                }
+                for d in new
+            ]
+        ).all()
+    )
+
+    for d in new:
+        d["id"] = ids[d["doc_entry"]]
+
+    line_rows = [
+        {
+            "delivery_id": d["id"],
+            "line_num": item["line_num"],
+            "item_code": item["item_code"],
+            "item_name": item["item_name"],
+            "quantity": item["quantity"],
+            "price": item["price"],
+            "line_total": item["line_total"]
+        }
+        for d in new
+        for item in d["items"]
+    ]
+
+    if line_rows:
+        db.execute(insert(DeliveryItem), line_rows)
+
+    return new
+
+
+def enqueue_notifications(db, inserted: list[dict]) -> int:
+    """
+    Writes one outbox row per active user of each new delivery.
+
+    Runs inside the ingest transaction; rendering and sending happen
+    later in worker/notify_dispatch.py.
+    """
+    if not inserted:
+        return 0
+
+    # 🔔 find telegram users for all CardCodes of the batch at once
+    card_codes = {d["card_code"] for d in inserted}
+    users_by_card: dict[str, list[int]] = {}
+    for card_code, telegram_id in db.query(
+        TelegramUser.card_code, TelegramUser.telegram_id
+    ).filter(
+        TelegramUser.card_code.in_(card_codes),
+        TelegramUser.is_active == True
+    ):
+        users_by_card.setdefault(card_code, []).append(telegram_id)
+
+    rows = [
+        {"delivery_id": d["id"], "telegram_id": telegram_id}
+        for d in inserted
+        for telegram_id in users_by_card.get(d["card_code"], [])
+    ]
+
+    if rows:
+        db.execute(insert(NotificationOutbox), rows)
+
+    return len(rows)
+
+
+def _delivery_header(r: dict) -> dict:
+    return {
+        "doc_entry": r["DocEntry"],
+        "document_number": r["DocNum"],
+        "card_code": r["CardCode"],
+        "card_name": r["CardName"],
+        "date": r["DocDate"],
+        "sales_manager": r["SlpName"],
+        "remarks": r["Comments"],
+        "total_amount": r["DocTotal"],
+        "currency": r["DocCur"],
+        "items": []
+    }
+
+
+def _delivery_line(r: dict) -> dict:
+    return {
+        "line_num": r["LineNum"],
+        "item_code": r["ItemCode"],
+        "item_name": r["ItemName"],
+        "quantity": r["Quantity"],
+        "price": r["Price"],
+        "line_total": r["LineTotal"]
+    }
+
+
+def iter_grouped_deliveries(rows: Iterable[dict]) -> Iterator[dict]:
+    """
+    Groups a row stream ordered by DocEntry into deliveries.
+
+    A delivery is yielded as soon as the next DocEntry starts (or the
+    stream ends), so at most one delivery is buffered at a time.
+    """
+    current = None
 
     for r in rows:
-        doc_entry = r["DocEntry"]
-
-        if doc_entry not in deliveries:
-            deliveries[doc_entry] = {
-                "doc_entry": doc_entry,
-                "document_number": r["DocNum"],
-                "card_code": r["CardCode"],
-                "card_name": r["CardName"],
-                "date": r["DocDate"],
-                "sales_manager": r["SlpName"],
-                "remarks": r["Comments"],
-                "total_amount": r["DocTotal"],
-                "currency": r["DocCur"],
-                "items": []
-            }
-
-        deliveries[doc_entry]["items"].append({
-            "line_num": r["LineNum"],
-            "item_code": r["ItemCode"],
-            "item_name": r["ItemName"],
-            "quantity": r["Quantity"],
-            "price": r["Price"],
-            "line_total": r["LineTotal"]
-        })
-
-    return deliveries
+        if current is None or current["doc_entry"] != r["DocEntry"]:
+            if current is not None:
+                yield current
+            current = _delivery_header(r)
+
+        current["items"].append(_delivery_line(r))
+
+    if current is not None:
+        yield current
 
 
 def get_last_doc_entry(db):
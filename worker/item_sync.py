@@ -1,134 +1,372 @@
 # worker/item_sync.py
 import asyncio
 import os
-import requests
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from sqlalchemy.orm import Session
+from typing import Iterator
+
+from sqlalchemy.dialects.sqlite import insert
 
 from shared.db import SessionLocal
-from shared.models import Item
-
-# Config (Reuse or duplicate from sap_sl_sync for now, or move to unified config later)
-SL_HOST = os.getenv("SL_HOST", "https://hana_host:50000/b1s/v1")
-SL_COMPANYDB = os.getenv("SL_COMPANYDB", "CompanyDB")
-SL_USER = os.getenv("SL_USER", "username")
-SL_PASSWORD = os.getenv("SL_PASSWORD", "password")
-
-def get_sl_session():
-    s = requests.Session()
-    credentials = {
-        "CompanyDB": SL_COMPANYDB,
-        "UserName": SL_USER,
-        "Password": SL_PASSWORD
-    }
-    resp = s.post(f"{SL_HOST}/Login", json=credentials, verify=False)
+from shared.hana import SL_COMPANYDB, hana_connection
+from shared.item_search import index_items, reindex_items
+from shared.models import Item, ItemSearch
+from shared.service_layer import get_sl_client
+from shared.sync_state import get_state, max_watermark, parse_watermark, set_state
+
+ITEM_SYNC_PAGE_SIZE = int(os.getenv("ITEM_SYNC_PAGE_SIZE", 200))
+ITEM_SYNC_CONCURRENCY = int(os.getenv("ITEM_SYNC_CONCURRENCY", 4))  # pages in flight
+
+# Delta runs (HANA) pick up stock and price changes every few minutes;
+# the full Service Layer reconcile re-reads the whole catalog as a safety net
+ITEM_FULL_RECONCILE_EVERY = int(os.getenv("ITEM_FULL_RECONCILE_EVERY", 3600 * 6))
+
+WATERMARK_KEY = "item_sync.watermark"      # "<UpdateDate>|<UpdateTS>" of OITM
+STOCK_WATERMARK_KEY = "item_sync.transnum"  # last seen OINM "TransNum"
+LAST_FULL_KEY = "item_sync.last_full"      # ISO datetime (UTC)
+
+BASE_PRICE_LIST = 1
+
+# Filter: Valid='Y', Frozen='N'
+ITEMS_FILTER = "Valid eq 'Y' and Frozen eq 'N'"
+ITEMS_SELECT = "ItemCode,ItemName,QuantityOnStock,ItemPrices"
+
+# Every inventory posting (deliveries, receipts, transfers...) adds an OINM
+# row, while OITM.UpdateDate only moves on master data / price edits
+LAST_TRANSNUM_QUERY = f"""
+    SELECT IFNULL(MAX("TransNum"), 0) FROM "{SL_COMPANYDB}"."OINM"
+"""
+
+ITEMS_DELTA_QUERY = f"""
+    SELECT
+        T0."ItemCode",
+        T0."ItemName",
+        T0."OnHand",
+        T1."Price",
+        T1."Currency",
+        T0."validFor",
+        T0."frozenFor",
+        T0."UpdateDate",
+        T0."UpdateTS"
+    FROM "{SL_COMPANYDB}"."OITM" T0
+    LEFT JOIN "{SL_COMPANYDB}"."ITM1" T1
+           ON T1."ItemCode" = T0."ItemCode" AND T1."PriceList" = {BASE_PRICE_LIST}
+    WHERE T0."ItemCode" IN (
+              SELECT "ItemCode" FROM "{SL_COMPANYDB}"."OINM" WHERE "TransNum" > ?
+          )
+       OR T0."UpdateDate" > ?
+       OR (T0."UpdateDate" = ? AND IFNULL(T0."UpdateTS", 0) >= ?)
+"""
+
+
+# Newest OITM edit, the delta watermark a full pass starts from
+LAST_UPDATE_QUERY = f"""
+    SELECT "UpdateDate", "UpdateTS" FROM "{SL_COMPANYDB}"."OITM"
+    WHERE "UpdateDate" IS NOT NULL
+    ORDER BY "UpdateDate" DESC, "UpdateTS" DESC
+    LIMIT 1
+"""
+
+# Status of items a full pass didn't return, before they are hidden
+ITEMS_STATUS_QUERY = f"""
+    SELECT "ItemCode", "validFor", "frozenFor"
+    FROM "{SL_COMPANYDB}"."OITM"
+    WHERE "ItemCode" IN ({{placeholders}})
+"""
+ITEMS_STATUS_CHUNK = 500
+
+
+def count_items() -> int | None:
+    resp = get_sl_client().get("Items/$count", params={"$filter": ITEMS_FILTER})
     if resp.status_code != 200:
-        print(f"SL Login Failed: {resp.text}")
         return None
-    return s
+    try:
+        return int(resp.text.strip())
+    except ValueError:
+        return None
+
+
+def fetch_items_page(skip: int, top: int) -> list[dict]:
+    resp = get_sl_client().get(
+        "Items",
+        params={
+            "$select": ITEMS_SELECT,
+            "$filter": ITEMS_FILTER,
+            "$orderby": "ItemCode",  # stable paging
+            "$top": top,
+            "$skip": skip
+        },
+        # Service Layer caps pages at its own B1S_PageSize unless asked
+        headers={"Prefer": f"odata.maxpagesize={top}"}
+    )
+    if resp.status_code != 200:
+        raise RuntimeError(f"Failed to fetch Items: {resp.status_code} - {resp.text}")
+
+    return resp.json().get("value", [])
+
+
+def iter_item_pages(
+    page_size: int = ITEM_SYNC_PAGE_SIZE,
+    concurrency: int = ITEM_SYNC_CONCURRENCY
+) -> Iterator[list[dict]]:
+    """
+    Yields /Items pages in order while up to `concurrency` further pages
+    are already being fetched, so HTTP round trips overlap the caller's
+    database writes.
+    """
+    total = count_items()  # None: page until a short page comes back
+    next_skip = 0
+    exhausted = False
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = deque()
+
+        def submit():
+            nonlocal next_skip
+            pending.append(pool.submit(fetch_items_page, next_skip, page_size))
+            next_skip += page_size
+
+        def has_more() -> bool:
+            return not exhausted and (total is None or next_skip < total)
+
+        while len(pending) < concurrency and has_more():
+            submit()
+
+        while pending:
+            page = pending.popleft().result()
+            if len(page) < page_size and total is None:
+                # with a count, a short page may just be a window that
+                # shifted (items changed mid-pass): keep going to `total`
+                exhausted = True
 
-def sync_items():
-    print("Starting Item Sync...")
-    s = get_sl_session()
-    if not s:
+            if has_more():
+                submit()
+
+            if page:
+                yield page
+
+
+def parse_item(i: dict, now: datetime) -> dict:
+    # NOTE: Pricing is complex in SAP B1. Price List 1 is the base price.
+    price = 0.0
+    currency = "USD"
+
+    for p in i.get("ItemPrices") or []:
+        if p["PriceList"] == BASE_PRICE_LIST:
+            price = p["Price"] or 0.0
+            currency = p["Currency"] or "USD"
+            break
+
+    return {
+        "item_code": i["ItemCode"],
+        "item_name": i["ItemName"],
+        "quantity": i["QuantityOnStock"],
+        "price": price,
+        "currency": currency,
+        "updated_at": now
+    }
+
+
+def upsert_items(db, rows: list[dict]):
+    """Bulk INSERT ... ON CONFLICT(item_code) DO UPDATE, plus search keys."""
+    if not rows:
         return
 
-    try:
-        skip = 0
-        top = 20
-        total_synced = 0
-
-        while True:
-            # Fetch Items (OITM)
-            # Filter: Valid='Y', SalesItem='Y', maybe Frozen='N'
-            # Select: ItemCode, ItemName, QuantityOnStock, PriceList info...
-            
-            # NOTE: Pricing is complex in SAP B1. We'll try to fetch from 'ItemPrices' or a specific Price List.
-            # Let's assume Price List 1 is the base price.
-            
-            url = f"{SL_HOST}/Items"
-            params = {
-                "$select": "ItemCode,ItemName,QuantityOnStock,ItemPrices",
-                "$filter": "Valid eq 'Y' and Frozen eq 'N'",
-                "$top": top,
-                "$skip": skip
+    stmt = insert(Item)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Item.item_code],
+        set_={
+            "item_name": stmt.excluded.item_name,
+            "quantity": stmt.excluded.quantity,
+            "price": stmt.excluded.price,
+            "currency": stmt.excluded.currency,
+            "updated_at": stmt.excluded.updated_at,
+        }
+    )
+    db.execute(stmt, rows)
+    index_items(db, rows)  # search keys, same transaction
+
+
+def reconcile_items(db) -> int:
+    """
+    Full catalog pass over the Service Layer. Items no longer returned
+    get quantity 0, which hides them in the WebApp, once HANA confirms
+    they are invalid, frozen or gone: $skip windows shift when items
+    change mid-pass, so "not returned" alone doesn't prove it.
+    """
+    started = datetime.utcnow()
+    total_synced = 0
+
+    for items_data in iter_item_pages():
+        now = datetime.utcnow()
+        upsert_items(db, [parse_item(i, now) for i in items_data])
+        db.commit()
+
+        total_synced += len(items_data)
+        print(f"Synced batch of {len(items_data)} items. Total: {total_synced}")
+
+    missed = [
+        code for (code,) in db.query(Item.item_code).filter(
+            Item.updated_at < started,
+            Item.quantity != 0
+        )
+    ]
+    hidden = inactive_item_codes(missed)
+    if hidden:
+        db.query(Item).filter(Item.item_code.in_(hidden)).update(
+            {"quantity": 0, "updated_at": started}, synchronize_session=False
+        )
+    if len(hidden) < len(missed):
+        print(f"{len(missed) - len(hidden)} items missed by the full pass are still active in SAP")
+
+    return total_synced
+
+
+def inactive_item_codes(codes: list[str]) -> list[str]:
+    """Those of `codes` that OITM has as invalid or frozen, or doesn't have at all."""
+    inactive = []
+    with hana_connection() as conn:
+        for start in range(0, len(codes), ITEMS_STATUS_CHUNK):
+            chunk = codes[start:start + ITEMS_STATUS_CHUNK]
+            query = ITEMS_STATUS_QUERY.format(placeholders=", ".join("?" * len(chunk)))
+            cursor = conn.statement(query)
+            cursor.execute(query, chunk)
+            active = {
+                item_code
+                for item_code, valid_for, frozen_for in cursor.fetchall()
+                if valid_for == "Y" and frozen_for != "Y"
             }
-            
-            print(f"Fetching items with skip={skip}, top={top}...")
-            resp = s.get(url, params=params, verify=False)
-            if resp.status_code != 200:
-                print(f"Failed to fetch Items: {resp.status_code} - {resp.text}")
-                break
-
-            data = resp.json()
-            items_data = data.get("value", [])
-            
-            if not items_data:
-                print("No more items to fetch.")
-                break
-
-            db = SessionLocal()
-            try:
-                for i in items_data:
-                    code = i["ItemCode"]
-                    name = i["ItemName"]
-                    qty = i["QuantityOnStock"]
-                    
-                    # Extract Price from Price List 1
-                    price = 0.0
-                    currency = "USD"
-                    
-                    if "ItemPrices" in i:
-                        for p in i["ItemPrices"]:
-                            if p["PriceList"] == 1: # Base Price List
-                                price = p["Price"] or 0.0
-                                currency = p["Currency"] or "USD"
-                                break
-                                
-                    # Upsert to DB
-                    existing = db.query(Item).filter(Item.item_code == code).first()
-                    if existing:
-                        existing.item_name = name
-                        existing.quantity = qty
-                        existing.price = price
-                        existing.currency = currency
-                        existing.updated_at = datetime.utcnow()
-                    else:
-                        new_item = Item(
-                            item_code=code,
-                            item_name=name,
-                            quantity=qty,
-                            price=price,
-                            currency=currency
-                        )
-                        db.add(new_item)
-                
-                db.commit()
-                batch_count = len(items_data)
-                total_synced += batch_count
-                print(f"Synced batch of {batch_count} items. Total: {total_synced}")
-                
-                if len(items_data) < top:
-                    print("Fetched fewer items than requested (last page).")
-                    break
-
-                skip += top
-                
-            except Exception as e:
-                print(f"DB Error during item sync: {e}")
-                db.rollback()
-            finally:
-                db.close()
-
-    except Exception as e:
-        print(f"Item Sync Exception: {e}")
+            inactive += [code for code in chunk if code not in active]
+    return inactive
+
+
+def load_changed_items(since: tuple[str, int] | None, transnum: int) -> list[dict]:
+    """Items with inventory postings after `transnum` or edited since `since`."""
+    since = since or ("1900-01-01", 0)
+
+    with hana_connection() as conn:
+        cursor = conn.statement(ITEMS_DELTA_QUERY)
+        cursor.execute(ITEMS_DELTA_QUERY, (transnum, since[0], since[0], since[1]))
+        rows = cursor.fetchall()
+
+    return [
+        {
+            "item_code": item_code,
+            "item_name": item_name,
+            "quantity": on_hand or 0.0,
+            "price": price or 0.0,
+            "currency": currency or "USD",
+            "active": valid_for == "Y" and frozen_for != "Y",
+            "update_date": str(update_date)[:10] if update_date else None,
+            "update_ts": update_ts
+        }
+        for (item_code, item_name, on_hand, price, currency,
+             valid_for, frozen_for, update_date, update_ts) in rows
+    ]
+
+
+def last_transnum() -> int:
+    with hana_connection() as conn:
+        cursor = conn.statement(LAST_TRANSNUM_QUERY)
+        cursor.execute(LAST_TRANSNUM_QUERY)
+        return int(cursor.fetchone()[0])
+
+
+def last_update_watermark() -> str | None:
+    with hana_connection() as conn:
+        cursor = conn.statement(LAST_UPDATE_QUERY)
+        cursor.execute(LAST_UPDATE_QUERY)
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+    update_date, update_ts = row
+    return max_watermark([{"update_date": str(update_date)[:10], "update_ts": update_ts}])
+
+
+def sync_items_delta(db, watermark: str | None, transnum: int) -> int:
+    changed = load_changed_items(parse_watermark(watermark), transnum)
+
+    now = datetime.utcnow()
+    columns = ("item_code", "item_name", "quantity", "price", "currency")
+    upsert_items(db, [
+        {**{c: i[c] for c in columns}, "updated_at": now}
+        for i in changed if i["active"]
+    ])
+
+    inactive = [i["item_code"] for i in changed if not i["active"]]
+    if inactive:
+        db.query(Item).filter(Item.item_code.in_(inactive)).update(
+            {"quantity": 0, "updated_at": now}, synchronize_session=False
+        )
+
+    new_watermark = max_watermark(changed)
+    if new_watermark and (watermark is None or new_watermark > watermark):
+        set_state(db, WATERMARK_KEY, new_watermark)
+
+    return len(changed)
+
+
+def sync_items(full: bool | None = None):
+    """
+    Syncs the marketplace catalog (Item) from SAP.
+
+    :param full: force (True) or skip (False) the full reconcile;
+                 by default it runs every ITEM_FULL_RECONCILE_EVERY seconds
+    """
+    db = SessionLocal()
+    started = time.perf_counter()
+    try:
+        now = datetime.utcnow()
+        watermark = get_state(db, WATERMARK_KEY)
+        stock_watermark = get_state(db, STOCK_WATERMARK_KEY)
+        last_full = get_state(db, LAST_FULL_KEY)
+
+        if full is None:
+            full = (
+                stock_watermark is None
+                or last_full is None
+                or (now - datetime.fromisoformat(last_full)).total_seconds()
+                >= ITEM_FULL_RECONCILE_EVERY
+            )
+
+        if db.query(ItemSearch.id).first() is None and db.query(Item.item_code).first():
+            print(f"Indexed {reindex_items(db)} items for search")
+
+        # read before the items, so postings made meanwhile are caught next run
+        transnum = last_transnum()
+
+        if full:
+            # the pass covers every edit up to here, so the next delta starts from it
+            update_watermark = last_update_watermark()
+            count = reconcile_items(db)
+            set_state(db, LAST_FULL_KEY, now.isoformat())
+            if update_watermark and (watermark is None or update_watermark > watermark):
+                set_state(db, WATERMARK_KEY, update_watermark)
+        else:
+            count = sync_items_delta(db, watermark, int(stock_watermark))
+
+        set_state(db, STOCK_WATERMARK_KEY, str(transnum))
+        db.commit()
+
+        print(
+            f"Item sync ({'full' if full else 'delta'}): "
+            f"{count} items in {time.perf_counter() - started:.1f}s"
+        )
+
+    except Exception:
+        db.rollback()
+        raise
     finally:
-        s.close()
+        db.close()
+
 
 async def item_sync_loop(period: int):
     while True:
         try:
-            sync_items()
+            await asyncio.to_thread(sync_items)
         except Exception as e:
             print(f"Item Sync Loop Error: {e}")
         await asyncio.sleep(period)
@@ -5,17 +5,29 @@ from worker.hana_sync import hana_sync_loop
 from worker.bp_sync import bp_sync_loop
 from worker.sap_sl_sync import sap_sl_sync_loop
 from worker.item_sync import item_sync_loop
-from worker.order_sync import order_sync_loop
+from worker.order_sync import order_queue_loop
+from worker.notify_dispatch import notification_dispatch_loop
+from shared.render_pool import shutdown_render_executor, start_render_pool
+from shared.service_layer import close_sl_client
+from shared.telegram_client import close_telegram_client
 
 
 async def main():
-    await asyncio.gather(
-        hana_sync_loop(period=3600),      # deliveries from SAP
-        sap_sl_sync_loop(period=3600),     # approvals to SAP
-        bp_sync_loop(period=3600*6),    # BP sync every 6h - 3600 * 6
-        item_sync_loop(period=3600*6),    # Item sync every 6h
-        #order_sync_loop(period=60),     # Order sync every 1 min (or faster/slower)
-    )
+    try:
+        await start_render_pool()  # fonts loaded before the first delivery
+
+        await asyncio.gather(
+            hana_sync_loop(period=3600),      # deliveries: ODLN probe every 5 s, fetch on change
+            notification_dispatch_loop(period=5),  # outbox → Telegram
+            sap_sl_sync_loop(period=3600),     # approvals → SAP on commit, rejected ones retried hourly
+            bp_sync_loop(period=300),       # BP delta every 5 min, full reconcile every 6h
+            item_sync_loop(period=120),      # stock/price delta every 2 min, full reconcile every 6h
+            order_queue_loop(),             # orders → SAP right after checkout
+        )
+    finally:
+        shutdown_render_executor()
+        close_sl_client()  # /Logout, frees the B1SESSIONs
+        await close_telegram_client()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,336 @@
+# worker/notify_dispatch.py
+
+import asyncio
+import datetime
+import os
+
+from sqlalchemy import and_, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import selectinload
+
+from shared.db import SessionLocal
+from shared.image_renderer import payload_hash
+from shared.leases import claim, release
+from shared.models import Delivery, DeliveryImage, NotificationOutbox, TelegramUser
+from shared.payloads import build_delivery_payload
+from shared.render_pool import render_in_pool
+from shared.telegram_notify import (
+    AlbumIncomplete,
+    send_telegram_delivery_album,
+    send_telegram_delivery_image,
+)
+
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", 200))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", 30))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", 5))
+NOTIFY_RETRY_BASE = int(os.getenv("NOTIFY_RETRY_BASE", 30))  # seconds
+
+
+def delivery_caption(payload: dict) -> str:
+    doc_date = datetime.datetime.strptime(payload["date"], "%Y-%m-%d %H:%M:%S")
+    return (
+        f"<b>📦 Новая отгрузка</b>\n"
+        f"No: <b>{payload['document_number']}</b>\n"
+        f"Дата: {doc_date.strftime('%d.%m.%Y')}\n"
+        f"Сумма: <b>{payload['total_amount']:,.2f}</b>"
+    )
+
+
+def delivery_items_payload(delivery: Delivery) -> list[dict]:
+    return [
+        {
+            "line_num": item.line_num,
+            "item_code": item.item_code,
+            "item_name": item.item_name,
+            "quantity": item.quantity,
+            "price": item.price,
+            "line_total": item.line_total,
+            "uom": ""
+        }
+        for item in sorted(delivery.items, key=lambda i: i.line_num)
+    ]
+
+
+async def send_delivery_notification(
+    payload: dict,
+    user: TelegramUser,
+    image_paths: list[str],
+    file_ids: list[str] | None = None,
+    pages_sent: int = 0
+) -> list[str] | None:
+    """
+    Sends a single-page invoice as one photo and longer ones as a
+    media group, resuming after the `pages_sent` pages an earlier attempt
+    delivered. Returns the Telegram file_ids of the sent pages.
+    """
+    caption = delivery_caption(payload)
+
+    if len(image_paths) > 1:
+        return await send_telegram_delivery_album(
+            user=user,
+            image_paths=image_paths,
+            caption=caption,
+            file_ids=file_ids,
+            pages_sent=pages_sent
+        )
+
+    file_id = await send_telegram_delivery_image(
+        user=user,
+        image_path=image_paths[0],
+        caption=caption,
+        file_id=file_ids[0] if file_ids else None
+    )
+    return [file_id] if file_id else None
+
+
+def load_due_jobs():
+    """
+    Leases one batch of due outbox rows, so worker replicas never send
+    the same notification, then reads them with their deliveries, users
+    and cached images, and builds the payloads.
+
+    Nothing is committed after the claim, so the returned objects stay
+    loaded after the session closes; the caller only reads them.
+
+    :return: (jobs, users, payloads, keys, images), None when nothing is due
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.datetime.utcnow()
+        ids = claim(
+            db, NotificationOutbox,
+            and_(
+                NotificationOutbox.status == "pending",
+                NotificationOutbox.next_attempt_at <= now
+            ),
+            NOTIFY_BATCH_SIZE
+        )
+        if not ids:
+            return None
+
+        jobs = (
+            db.query(NotificationOutbox)
+            .filter(NotificationOutbox.id.in_(ids))
+            .order_by(NotificationOutbox.id)
+            .all()
+        )
+
+        deliveries = {
+            d.id: d for d in
+            db.query(Delivery)
+              .options(selectinload(Delivery.items))
+              .filter(Delivery.id.in_({j.delivery_id for j in jobs}))
+        }
+        users = {
+            u.telegram_id: u for u in
+            db.query(TelegramUser)
+              .filter(TelegramUser.telegram_id.in_({j.telegram_id for j in jobs}))
+        }
+
+        # payloads are built here, the event loop only renders and sends
+        payloads = {
+            delivery_id: build_delivery_payload(d, delivery_items_payload(d))
+            for delivery_id, d in deliveries.items()
+        }
+        keys = {
+            delivery_id: payload_hash(payload)
+            for delivery_id, payload in payloads.items()
+        }
+        images: dict[str, list[DeliveryImage]] = {}
+        for img in (
+            db.query(DeliveryImage)
+              .filter(DeliveryImage.payload_hash.in_(set(keys.values())))
+              .order_by(DeliveryImage.page)
+        ):
+            images.setdefault(img.payload_hash, []).append(img)
+
+        return jobs, users, payloads, keys, images
+    finally:
+        db.close()
+
+
+def save_results(
+    job_ids: list[int],
+    skipped: set[int],
+    results: dict[int, list[str] | None | Exception],
+    pages: list[DeliveryImage]
+):
+    """
+    Records the outcome of a batch and releases its lease: sent,
+    skipped, retried with exponential backoff or failed after
+    NOTIFY_MAX_ATTEMPTS. New pages and first-upload file_ids go to the
+    image cache; a replica that uploaded the same page first keeps its
+    file_id.
+    """
+    db = SessionLocal()
+    try:
+        if pages:
+            stmt = insert(DeliveryImage)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[DeliveryImage.payload_hash, DeliveryImage.page],
+                set_={"telegram_file_id": func.coalesce(
+                    DeliveryImage.telegram_file_id, stmt.excluded.telegram_file_id
+                )}
+            )
+            db.execute(stmt, [
+                {
+                    "payload_hash": p.payload_hash,
+                    "page": p.page,
+                    "delivery_id": p.delivery_id,
+                    "file_path": p.file_path,
+                    "telegram_file_id": p.telegram_file_id
+                }
+                for p in pages
+            ])
+
+        now = datetime.datetime.utcnow()
+        jobs = db.query(NotificationOutbox).filter(NotificationOutbox.id.in_(job_ids))
+        for job in jobs:
+            release(job)
+
+            if job.id in skipped:
+                job.status = "skipped"
+                continue
+
+            result = results.get(job.id)
+            job.attempts = (job.attempts or 0) + 1
+
+            if isinstance(result, list):
+                job.status = "sent"
+                job.sent_at = now
+                job.last_error = None
+                continue
+
+            job.last_error = (
+                str(result)[:250] if isinstance(result, Exception)
+                else "sendPhoto failed"
+            )
+            if isinstance(result, AlbumIncomplete):
+                # the retry doesn't post these pages to the chat again
+                job.pages_sent = result.pages_sent
+
+            if job.attempts >= NOTIFY_MAX_ATTEMPTS:
+                job.status = "failed"
+            else:
+                delay = NOTIFY_RETRY_BASE * 2 ** (job.attempts - 1)
+                job.next_attempt_at = now + datetime.timedelta(seconds=delay)
+
+        db.commit()
+    finally:
+        db.close()
+
+
+async def dispatch_notifications() -> int:
+    """
+    Sends one batch of due outbox rows concurrently.
+
+    Each delivery is rendered at most once (cached by payload hash) and
+    uploaded once; the remaining recipients get the Telegram file_ids of
+    that first upload. Failed sends are retried with exponential backoff
+    until NOTIFY_MAX_ATTEMPTS is reached.
+
+    Loading the batch and saving its results run in threads: a commit
+    waiting on the SQLite lock would otherwise stall every send and the
+    order queue sharing the event loop.
+
+    :return: number of outbox rows processed
+    """
+    batch = await asyncio.to_thread(load_due_jobs)
+    if batch is None:
+        return 0
+    jobs, users, payloads, keys, images = batch
+
+    skipped = set()
+    groups: dict[int, list[NotificationOutbox]] = {}
+    for job in jobs:
+        user = users.get(job.telegram_id)
+        if not user or not user.is_active or job.delivery_id not in payloads:
+            skipped.add(job.id)
+            continue
+        groups.setdefault(job.delivery_id, []).append(job)
+
+    semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+    results: dict[int, list[str] | None | Exception] = {}
+    changed_pages: list[DeliveryImage] = []
+
+    async def send(job, payload, image_paths, file_ids):
+        async with semaphore:
+            try:
+                results[job.id] = await send_delivery_notification(
+                    payload, users[job.telegram_id], image_paths, file_ids,
+                    pages_sent=job.pages_sent or 0
+                )
+            except Exception as e:
+                results[job.id] = e
+        return results[job.id]
+
+    async def run_delivery(delivery_id, group):
+        payload = payloads[delivery_id]
+        key = keys[delivery_id]
+        pages = images.get(key)
+
+        if not pages or not all(p.telegram_file_id for p in pages):
+            try:
+                # no-op when the pages for this payload are already on disk
+                paths = await render_in_pool(payload, key)
+            except Exception as e:
+                for job in group:
+                    results[job.id] = e
+                return
+
+            if not pages:
+                pages = [
+                    DeliveryImage(
+                        payload_hash=key,
+                        page=n,
+                        delivery_id=delivery_id,
+                        file_path=path
+                    )
+                    for n, path in enumerate(paths, 1)
+                ]
+                images[key] = pages
+                changed_pages.extend(pages)
+
+        paths = [p.file_path for p in pages]
+
+        def file_ids():
+            ids = [p.telegram_file_id for p in pages]
+            return ids if all(ids) else None
+
+        # upload until one recipient succeeds, then fan out by file_id
+        pending = list(group)
+        while pending and not file_ids():
+            result = await send(pending.pop(0), payload, paths, None)
+            if isinstance(result, list) and len(result) == len(pages):
+                for page, file_id in zip(pages, result):
+                    page.telegram_file_id = file_id
+                    if page not in changed_pages:
+                        changed_pages.append(page)
+
+        await asyncio.gather(*(
+            send(job, payload, paths, file_ids())
+            for job in pending
+        ))
+
+    await asyncio.gather(*(
+        run_delivery(delivery_id, group)
+        for delivery_id, group in groups.items()
+    ), return_exceptions=True)
+
+    await asyncio.to_thread(
+        save_results, [j.id for j in jobs], skipped, results, changed_pages
+    )
+    return len(jobs)
+
+
+async def notification_dispatch_loop(period: int):
+    while True:
+        try:
+            processed = await dispatch_notifications()
+        except Exception as e:
+            print("Notification dispatch error:", e)
+            processed = 0
+
+        # keep draining while there is a backlog
+        if not processed:
+            await asyncio.sleep(period)
@@ -1,100 +1,203 @@
 # worker/order_sync.py
 import asyncio
-import os
-import requests
 import datetime
-from shared.db import SessionLocal
-from shared.models import Order, OrderItem
-
-SL_HOST = os.getenv("SL_HOST", "https://hana_host:50000/b1s/v1")
-SL_COMPANYDB = os.getenv("SL_COMPANYDB", "CompanyDB")
-SL_USER = os.getenv("SL_USER", "username")
-SL_PASSWORD = os.getenv("SL_PASSWORD", "password")
-
-def get_sl_session():
-    s = requests.Session()
-    credentials = {
-        "CompanyDB": SL_COMPANYDB,
-        "UserName": SL_USER,
-        "Password": SL_PASSWORD
+import os
+import time
+from sqlalchemy.orm import selectinload
+from shared.db import SessionLocal, engine
+from shared.leases import release, renew
+from shared.models import Order, OrderJob
+from shared.order_queue import ORDER_LEASE_SECONDS, CommitWatcher, claim_jobs, enqueue_missing
+from shared.service_layer import SL_BATCH_SIZE, error_message, get_sl_client, send_batch
+
+ORDER_QUEUE_POLL = float(os.getenv("ORDER_QUEUE_POLL", 0.05))  # seconds
+ORDER_QUEUE_RECHECK = float(os.getenv("ORDER_QUEUE_RECHECK", 5))
+ORDER_MAX_ATTEMPTS = int(os.getenv("ORDER_MAX_ATTEMPTS", 5))
+ORDER_RETRY_BASE = int(os.getenv("ORDER_RETRY_BASE", 10))  # seconds, doubled per attempt
+
+# Document field carrying the idempotency key of each order in SAP
+SL_ORDER_KEY_FIELD = os.getenv("SL_ORDER_KEY_FIELD", "NumAtCard")
+
+
+def order_key(order: Order) -> str:
+    return f"TG-{order.id}"
+
+
+def order_payload(order: Order) -> dict:
+    # Prepare Payload for SAP B1 Orders (Sales Order)
+    # DocType: dDocument_Items
+    # CardCode: order.card_code (must be valid BP)
+    lines = []
+    for item in order.items:
+        lines.append({
+            "ItemCode": item.item_code,
+            "Quantity": item.quantity,
+            # "Price": item.price # Optional: Let SAP determine price or override
+        })
+
+    return {
+        "CardCode": order.card_code,
+        "DocDate": datetime.date.today().isoformat(),
+        "DocDueDate": datetime.date.today().isoformat(),
+        "DocumentLines": lines,
+        "Comments": f"From Telegram Bot (Order #{order.id})",
+        SL_ORDER_KEY_FIELD: order_key(order)
     }
-    resp = s.post(f"{SL_HOST}/Login", json=credentials, verify=False)
-    if resp.status_code != 200:
-        print(f"SL Login Failed: {resp.text}")
-        return None
-    return s
-
-def sync_orders():
-    # 1. Find 'new' orders
+
+
+def find_sap_orders(orders: list[Order]) -> dict[str, dict]:
+    """
+    SAP documents already created for `orders`, by idempotency key.
+    An earlier attempt may have reached SAP even though its result never
+    made it back (timeout, worker crash).
+    """
+    keys = [order_key(o) for o in orders]
+    # every page: a match missed here would be posted a second time
+    docs = get_sl_client().get_all(
+        "Orders",
+        page_size=len(keys),
+        params={
+            "$select": f"DocEntry,DocNum,{SL_ORDER_KEY_FIELD}",
+            "$filter": " or ".join(f"{SL_ORDER_KEY_FIELD} eq '{k}'" for k in keys)
+        }
+    )
+    return {doc[SL_ORDER_KEY_FIELD]: doc for doc in docs}
+
+
+def apply_order_result(job: OrderJob, status: int, body, now: datetime.datetime):
+    order = job.order
+
+    if status == 201 and isinstance(body, dict):
+        order.sap_doc_entry = body.get("DocEntry")
+        order.sap_doc_num = str(body.get("DocNum"))
+        order.status = "synced"
+        order.sap_error = None
+        job.status = "done"
+        job.last_error = None
+        job.finished_at = now
+        release(job)
+        print(f"Order {order.id} created in SAP: DocEntry {order.sap_doc_entry}")
+    elif status >= 500 or status == 424:
+        # server trouble, or not executed within the $batch: try again
+        retry_job(job, error_message(body), now)
+    else:
+        # rejected by SAP (bad BP, item...): retrying won't help
+        err_msg = error_message(body)
+        print(f"Failed to create Order {order.id}: {err_msg}")
+        fail_job(job, err_msg, now)
+
+
+def fail_job(job: OrderJob, error: str, now: datetime.datetime):
+    job.status = "failed"
+    job.last_error = error[:250]
+    job.finished_at = now
+    release(job)
+    job.order.status = "error"
+    job.order.sap_error = error[:250]  # Truncate
+
+
+def retry_job(job: OrderJob, error: str, now: datetime.datetime):
+    if job.attempts >= ORDER_MAX_ATTEMPTS:
+        print(f"Giving up on Order {job.order_id} after {job.attempts} attempts: {error}")
+        fail_job(job, error, now)
+        return
+
+    job.status = "pending"
+    job.last_error = error[:250]
+    release(job)
+    job.next_attempt_at = now + datetime.timedelta(
+        seconds=ORDER_RETRY_BASE * 2 ** (job.attempts - 1)
+    )
+
+
+def process_order_jobs(limit: int = SL_BATCH_SIZE) -> int:
+    """
+    Leases up to `limit` due jobs and submits their orders in one $batch
+    call, committing local state once. Jobs tried before are first looked
+    up in SAP by idempotency key, so an order is never posted twice.
+
+    :return: number of jobs processed
+    """
     db = SessionLocal()
     try:
-        # We might want to lock these rows or handle concurrency, but for now simple fetch
-        new_orders = db.query(Order).filter(Order.status == 'new').all()
-        if not new_orders:
-            return
-
-        s = get_sl_session()
-        if not s:
-            return
-
-        for order in new_orders:
-            print(f"Syncing Order {order.id}...")
-            
-            # Prepare Payload for SAP B1 Orders (Sales Order)
-            # DocType: dDocument_Items
-            # CardCode: order.card_code (must be valid BP)
-            # DocumentLines: [ ... ]
-            
-            lines = []
-            for item in order.items:
-                lines.append({
-                    "ItemCode": item.item_code,
-                    "Quantity": item.quantity,
-                    # "Price": item.price # Optional: Let SAP determine price or override
-                })
-            
-            payload = {
-                "CardCode": order.card_code,
-                "DocDate": datetime.date.today().isoformat(),
-                "DocDueDate": datetime.date.today().isoformat(),
-                "DocumentLines": lines,
-                "Comments": f"From Telegram Bot (Order #{order.id})"
-            }
+        job_ids = claim_jobs(db, limit)
+        if not job_ids:
+            return 0
 
-            try:
-                resp = s.post(f"{SL_HOST}/Orders", json=payload, verify=False)
-                if resp.status_code == 201:
-                    data = resp.json()
-                    new_doc_entry = data.get("DocEntry")
-                    new_doc_num = str(data.get("DocNum"))
-                    
-                    order.sap_doc_entry = new_doc_entry
-                    order.sap_doc_num = new_doc_num
-                    order.status = "synced"
-                    order.sap_error = None
-                    print(f"Order {order.id} created in SAP: DocEntry {new_doc_entry}")
+        jobs = (
+            db.query(OrderJob)
+            .options(selectinload(OrderJob.order).selectinload(Order.items))
+            .filter(OrderJob.id.in_(job_ids))
+            .order_by(OrderJob.id)
+            .all()
+        )
+        print(f"Syncing Orders {[j.order_id for j in jobs]}...")
+
+        now = datetime.datetime.utcnow()
+        try:
+            retried = [j.order for j in jobs if j.attempts > 1]
+            existing = find_sap_orders(retried) if retried else {}
+
+            to_send = []
+            for job in jobs:
+                doc = existing.get(order_key(job.order))
+                if doc:
+                    apply_order_result(job, 201, doc, now)
                 else:
-                    err_msg = resp.text
-                    print(f"Failed to create Order {order.id}: {err_msg}")
-                    order.status = "error"
-                    order.sap_error = err_msg[:250] # Truncate
-                    
-            except Exception as e:
-                print(f"Exception creating order {order.id}: {e}")
-                order.status = "error"
-                order.sap_error = str(e)[:250]
-                
+                    to_send.append(job)
+
+            if to_send:
+                # a fresh lease for the $batch call; a job whose lease ran
+                # out during the lookup and was taken over is left alone
+                held = set(renew(db, OrderJob, [j.id for j in to_send], ORDER_LEASE_SECONDS))
+                lost = [j for j in to_send if j.id not in held]
+                for job in lost:
+                    print(f"Lease on Order {job.order_id} lost, left to its new worker")
+                to_send = [j for j in to_send if j.id in held]
+                jobs = [j for j in jobs if j not in lost]
+
+            results = send_batch(
+                [("POST", "Orders", order_payload(j.order)) for j in to_send]
+            ) if to_send else []
+        except Exception as e:
+            print(f"Exception creating orders: {e}")
+            for job in jobs:
+                if job.status == "running":
+                    retry_job(job, str(e), now)
+        else:
+            for job, (status, body) in zip(to_send, results):
+                apply_order_result(job, status, body, now)
+
+        db.commit()
+        return len(jobs)
+    finally:
+        db.close()
+
+
+async def order_queue_loop(poll: float = ORDER_QUEUE_POLL):
+    """
+    Submits orders as soon as the API commits them: every `poll` seconds
+    the loop checks whether anyone wrote to the database and only then
+    looks for jobs. Retries come due without a commit, hence the recheck.
+    """
+    db = SessionLocal()
+    try:
+        if enqueue_missing(db):
             db.commit()
-            
-    except Exception as e:
-        print(f"Order Sync Error: {e}")
     finally:
         db.close()
 
-async def order_sync_loop(period: int):
-    while True:
-        try:
-            sync_orders()
-        except Exception as e:
-            print(f"Order Sync Loop Error: {e}")
-        await asyncio.sleep(period)
+    watcher = CommitWatcher(engine)
+    next_recheck = 0.0
+    try:
+        while True:
+            try:
+                if watcher.changed() or time.monotonic() >= next_recheck:
+                    next_recheck = time.monotonic() + ORDER_QUEUE_RECHECK
+                    while await asyncio.to_thread(process_order_jobs):
+                        pass
+            except Exception as e:
+                print(f"Order Queue Error: {e}")
+            await asyncio.sleep(poll)
+    finally:
+        watcher.close()
@@ -2,62 +2,100 @@
 
 import asyncio
 import os
+import time
 
-import requests
+from sqlalchemy import and_
 
-from shared.db import SessionLocal
+from shared.db import SessionLocal, engine
+from shared.leases import claim, release
 from shared.models import Delivery
+from shared.order_queue import CommitWatcher
+from shared.service_layer import SL_BATCH_SIZE, error_message, send_batch
 
-SL_HOST = os.getenv("SL_HOST", "https://hana_host:50000/b1s/v1")
-SL_COMPANYDB = os.getenv("SL_COMPANYDB", "CompanyDB")
-SL_USER = os.getenv("SL_USER", "username")
-SL_PASSWORD = os.getenv("SL_PASSWORD", "password")
+APPROVAL_SYNC_POLL = float(os.getenv("APPROVAL_SYNC_POLL", 0.5))  # seconds
+APPROVAL_SYNC_RECHECK = float(os.getenv("APPROVAL_SYNC_RECHECK", 30))
 
 
-def sync_approved_to_sap():
+def sync_approved_to_sap(skip: set[int] = frozenset()) -> set[int]:
+    """
+    Pushes approvals to SAP, SL_BATCH_SIZE deliveries per $batch call.
+    Rows are leased first, so several workers can run this side by side.
+    The PATCH is idempotent: re-sending U_Approved = 'Y' changes nothing.
+
+    :param skip: ids of deliveries SAP rejected recently
+    :return: ids of the deliveries SAP rejected this time
+    """
     db = SessionLocal()
+    failed = set()
     try:
-        deliveries = db.query(Delivery).filter(
-            Delivery.approved == True,
-            Delivery.sap_synced == False
-        ).all()
-
-        if not deliveries:
-            return
-
-        credentials = {
-            "CompanyDB": SL_COMPANYDB,
-            "UserName": SL_USER,
-            "Password": SL_PASSWORD
-        }
-
-        with requests.Session() as s:
-            login_resp = s.post(f"{SL_HOST}/Login", json=credentials, verify=False)
-            if login_resp.status_code != 200:
-                print("SAP Service Layer login failed")
-                return
-
-            for d in deliveries:
-                patch_resp = s.patch(
-                    f"{SL_HOST}/DeliveryNotes({d.doc_entry})",
-                    json={"U_Approved": "Y"},
-                    verify=False
-                )
-                if patch_resp.status_code == 204:
-                    d.sap_synced = True
-                    db.commit()
-                    print(f"Delivery {d.document_number} synced to SAP")
-                else:
-                    print(f"Failed to sync delivery {d.document_number}, status {patch_resp.status_code}")
+        while True:
+            ids = claim(
+                db, Delivery,
+                and_(
+                    Delivery.approved == True,
+                    Delivery.sap_synced == False,
+                    Delivery.id.notin_(failed | skip)
+                ),
+                SL_BATCH_SIZE
+            )
+            if not ids:
+                return failed
+
+            batch = db.query(Delivery).filter(Delivery.id.in_(ids)).order_by(Delivery.id).all()
+            try:
+                results = send_batch([
+                    ("PATCH", f"DeliveryNotes({d.doc_entry})", {"U_Approved": "Y"})
+                    for d in batch
+                ])
+
+                for d, (status, body) in zip(batch, results):
+                    if status == 204:
+                        d.sap_synced = True
+                        print(f"Delivery {d.document_number} synced to SAP")
+                    else:
+                        failed.add(d.id)
+                        print(
+                            f"Failed to sync delivery {d.document_number}, "
+                            f"status {status}: {error_message(body)}"
+                        )
+            finally:
+                # failed rows are retried next cycle
+                for d in batch:
+                    release(d)
+                db.commit()
+
+            if len(ids) < SL_BATCH_SIZE:
+                return failed
     finally:
         db.close()
 
 
-async def sap_sl_sync_loop(period: int):
-    while True:
-        try:
-            sync_approved_to_sap()
-        except Exception as e:
-            print("SAP SL sync error:", e)
-
-        await asyncio.sleep(period)
+async def sap_sl_sync_loop(period: int, poll: float = APPROVAL_SYNC_POLL):
+    """
+    Pushes approvals as soon as the API commits them, the way
+    order_queue_loop picks up orders: every `poll` seconds it checks
+    whether anyone wrote to the database, and every APPROVAL_SYNC_RECHECK
+    seconds it looks regardless. Deliveries SAP rejected are left out
+    for `period` seconds; after a transport error the loop pauses for
+    APPROVAL_SYNC_RECHECK seconds.
+    """
+    watcher = CommitWatcher(engine)
+    next_recheck = 0.0
+    retry_at: dict[int, float] = {}  # rejected delivery id -> next try
+    try:
+        while True:
+            now = time.monotonic()
+            if watcher.changed() or now >= next_recheck:
+                try:
+                    skip = {i for i, at in retry_at.items() if at > now}
+                    retry_at = {i: retry_at[i] for i in skip}
+                    failed = await asyncio.to_thread(sync_approved_to_sap, skip)
+                    retry_at.update((i, now + period) for i in failed)
+                    next_recheck = now + APPROVAL_SYNC_RECHECK
+                except Exception as e:
+                    print("SAP SL sync error:", e)
+                    # the recheck is due, so the next poll tries again
+                    await asyncio.sleep(APPROVAL_SYNC_RECHECK)
+            await asyncio.sleep(poll)
+    finally:
+        watcher.close()
@@ -1,33 +1,15 @@
-from hdbcli import dbapi
-
 from shared.db import SessionLocal
+from shared.hana import SL_COMPANYDB, hana_connection
 import datetime
-import os
 
 from shared.models import Delivery
 
-# --- HANA connection settings ---
-HANA_HOST = os.getenv("HANA_HOST", "hana_host")
-HANA_PORT = int(os.getenv("HANA_PORT", 30015))
-HANA_USER = os.getenv("HANA_USER", "username")
-HANA_PASSWORD = os.getenv("HANA_PASSWORD", "password")
-SL_COMPANYDB = os.getenv("SL_COMPANYDB", "CompanyDB")
-
 
 def fetch_deliveries_from_sap():
     """
     Connects to SAP B1 HANA and fetches new deliveries.
     Returns a list of dictionaries with keys matching our Delivery model.
     """
-    conn = dbapi.connect(
-        address=HANA_HOST,
-        port=HANA_PORT,
-        user=HANA_USER,
-        password=HANA_PASSWORD
-    )
-
-    cursor = conn.cursor()
-
     # Example query: deliveries from today
     query = f"""
     SELECT 
@@ -42,8 +24,10 @@ def fetch_deliveries_from_sap():
     WHERE T0."DocDate" >= CURRENT_DATE AND T0."U_Approved" = 'N'
     """
 
-    cursor.execute(query)
-    rows = cursor.fetchall()
+    with hana_connection() as conn:
+        cursor = conn.statement(query)
+        cursor.execute(query)
+        rows = cursor.fetchall()
 
     # Map SAP SlpCode to Sales Manager name if needed
     # For simplicity, we keep SlpCode as sales_manager
@@ -58,8 +42,6 @@ def fetch_deliveries_from_sap():
             "DocTotal": float(row[4])
         })
 
-    cursor.close()
-    conn.close()
     return deliveries
 
 